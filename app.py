@@ -4,6 +4,7 @@ from backend.categories.api import CategoriesAPI
 from backend.credentials.api import CredentialsAPI
 from backend.ml.api import MLAPI
 from backend.files.api import FilesAPI
+from backend.export.api import ExportAPI
 
 
 # Main entry-point and the event-loop, that runs only once.
@@ -22,6 +23,7 @@ def init_apis():
         st.session_state['api']['categories']   = CategoriesAPI()
         st.session_state['api']['ml']           = MLAPI()
         st.session_state['api']['files']        = FilesAPI()
+        st.session_state['api']['export']       = ExportAPI()
 
 
 # Application Constants
@@ -0,0 +1,23 @@
+from backend.google_cloud.api import GoogleCloudAPI
+from backend.files.filetype_registry import filetype_registry
+from backend.files.coding_registry import coding_registry
+from backend.categories.cache import category_cache
+from backend.ml.training_store import training_store
+from backend.ml.receiver_memo import receiver_memo
+from backend.ml.registry import model_registry
+
+
+def reset_caches():
+    ''' Drops every process-wide cache, and closes the pooled database connections.
+
+    Must be called when the database or the model file is removed or replaced
+    outside of the APIs, e.g. by the Reset All button, so that no stale rows,
+    memory maps or connections of the old files are used.
+    '''
+    GoogleCloudAPI.close_connections() # Release the pooled handles before the file is removed
+    filetype_registry.invalidate()
+    coding_registry.invalidate()
+    category_cache.invalidate()
+    training_store.invalidate()
+    receiver_memo.invalidate()
+    model_registry.clear() # Drop the memory maps of the model file
@@ -1,4 +1,5 @@
 from backend.google_cloud.api import GoogleCloudAPI
+from .cache import category_cache
 
 
 class CategoriesAPI():
@@ -8,31 +9,25 @@ class CategoriesAPI():
 
 
     def get_expenditure_categories(self):
-        sql = f"""
-        SELECT
-            Name
-        FROM 
-            {self.__client._dataset}.d_category
-        WHERE
-            Type = 'transaction'
-        GROUP BY
-            1 -- Group for case of duplication
-        """
-        df = self.__client.sql_to_pandas(sql) 
-
-        return df['Name'].to_list()
+        return category_cache.get_names('transaction')
     
 
     def get_asset_categories(self):
-        sql = f"""
-        SELECT
-            Name
-        FROM 
-            {self.__client._dataset}.d_category
-        WHERE
-            Type = 'asset'
-        GROUP BY
-            1 -- Group for case of duplication
+        return category_cache.get_names('asset')
+    
+
+    def get_category_id(self, name: str):
+        row = category_cache.get_row(name)
+        return row['KeyId'] if row is not None else None
+    
+
+    def get_category_explanation(self, name: str):
+        row = category_cache.get_row(name)
+        return row['Explanation'] if row is not None else None
+    
+
+    def refresh(self):
+        """ Reload the categories on the next access, 
+        must be called after d_category is modified
         """
-        df = self.__client.sql_to_pandas(sql) 
-        return df['Name'].to_list()
\ No newline at end of file
+        category_cache.invalidate()
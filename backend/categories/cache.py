@@ -0,0 +1,83 @@
+import threading
+import time
+from backend.google_cloud.api import GoogleCloudAPI
+
+
+class CategoryCache():
+    ''' Process-wide in-memory copy of the d_category table.
+
+    The table is loaded once, and served from memory until the
+    time-to-live expires, the cache is invalidated by a refresh, or the
+    database has changed. The change is detected from the data version of
+    the calling thread's pooled connection, that changes whenever an other
+    connection commits, e.g. the backfill CLI or an other server process.
+    Each reload increments the version number, that can be used
+    by the callers to detect changed categories.
+    '''
+
+    def __init__(self, ttl: float = 600.0):
+        self.__ttl = ttl
+        self.__lock = threading.Lock()
+        self.__rows = None # d_category rows as dicts, None if not loaded
+        self.__rows_by_name = {}
+        self.__loaded_at = 0.0
+        self.__version = 0
+        self.__seen = threading.local() # The data version that the calling thread's connection last validated the rows at
+
+
+    def get_names(self, category_type: str) -> list:
+        ''' Returns the unique category names of the type in alphabetical order
+
+        Inputs
+        ------
+        category_type : str
+            'transaction' or 'asset'
+        '''
+        return sorted({row['Name'] for row in self.__get_rows() if row['Type'] == category_type})
+    
+
+    def get_row(self, name: str) -> dict:
+        ''' Returns the d_category row of the name, or None if unknown
+        '''
+        self.__get_rows()
+        return self.__rows_by_name.get(name)
+
+
+    def invalidate(self):
+        ''' Drop the loaded categories, and reload on the next access
+        '''
+        with self.__lock:
+            self.__rows = None
+
+
+    @property
+    def version(self) -> int:
+        return self.__version
+
+
+    def __get_rows(self) -> list:
+        client = GoogleCloudAPI()
+        data_version = client.data_version()
+        with self.__lock:
+            is_changed = getattr(self.__seen, 'data_version', None) != data_version # Unknown for a new thread
+            if self.__rows is None or is_changed or time.monotonic() - self.__loaded_at > self.__ttl:
+                sql = f"""
+                SELECT
+                    KeyId,
+                    Type,
+                    Name,
+                    Explanation
+                FROM 
+                    {client._dataset}.d_category
+                ORDER BY
+                    KeyId
+                """
+                self.__rows = client.sql_to_pandas(sql).to_dict('records')
+                self.__rows_by_name = {row['Name']: row for row in reversed(self.__rows)} # The first row wins duplicates
+                self.__loaded_at = time.monotonic()
+                self.__version += 1
+            self.__seen.data_version = data_version
+            return self.__rows
+
+
+category_cache = CategoryCache()
@@ -16,9 +16,9 @@ class CredentialsAPI():
         FROM 
             {self.__client._dataset}.d_credentials     
         WHERE 
-            UserName = '{username}' AND PasswordHash = '{password_hash}'     
+            UserName = ? AND PasswordHash = ?     
         """
-        df = self.__client.sql_to_pandas(sql)
+        df = self.__client.sql_to_pandas(sql, params=(username, password_hash))
         if df['ct'][0] == 1:
             return True
         else:
@@ -37,15 +37,16 @@ class CredentialsAPI():
         FROM 
             {self.__client._dataset}.d_credentials  
         WHERE 
-            UserName = '{username}' AND PasswordHash = '{password_hash}'
+            UserName = ? AND PasswordHash = ?
         """
-        df = self.__client.sql_to_pandas(sql)
+        df = self.__client.sql_to_pandas(sql, params=(username, password_hash))
         if df.shape[0] == 1:
             return User(id=df['KeyUserId'][0] ,name=df['UserName'][0], role=df['Role'][0], is_logged_in=True)
         else:
             return User(-1, '', '', False)
         
     
+    @staticmethod
     def __is_valid_username(user_input: str):
         # Allow only alphanumeric characters and underscores
         return re.match(r"^[a-zA-Z0-9_]+$", user_input) is not None
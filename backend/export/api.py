@@ -0,0 +1,134 @@
+import gzip
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from backend.google_cloud.api import GoogleCloudAPI
+
+
+# Column types of the exported tables, explicit so that every chunk has the same schema
+_SCHEMAS = {
+    'f_transactions': pa.schema([
+        ('KeyDate', pa.date32()),
+        ('KeyUser', pa.string()),
+        ('Amount', pa.float64()),
+        ('Receiver', pa.string()),
+        ('Category', pa.string()),
+        ('CommitTimestamp', pa.timestamp('us', tz='UTC')),
+    ]),
+    'f_assets': pa.schema([
+        ('KeyDate', pa.date32()),
+        ('KeyUser', pa.string()),
+        ('Category', pa.string()),
+        ('Explanation', pa.string()),
+        ('Value', pa.float64()),
+        ('CommitTimestamp', pa.timestamp('us', tz='UTC')),
+    ]),
+}
+_MIN_DATE = '0001-01-01' # Bounds of an open date range, KeyDate is stored as an ISO string
+_MAX_DATE = '9999-12-31'
+
+
+class ExportAPI():
+    ''' Streams the rows of one user into Parquet or gzip CSV files.
+
+    The rows are read in chunks from a single read transaction, thus,
+    the file is a consistent snapshot even if other sessions commit
+    during the export, and only one chunk is in memory at a time.
+    '''
+
+    def __init__(self, chunk_size: int = 50000):
+        self.__client = GoogleCloudAPI()
+        self.__chunk_size = chunk_size
+
+
+    @staticmethod
+    def get_tables() -> list:
+        return list(_SCHEMAS.keys())
+
+
+    def export_table(self, out, user_name: str, table: str = 'f_transactions', file_format: str = 'parquet',
+                     date_from=None, date_to=None) -> dict:
+        ''' Writes the rows of the user into a binary file object
+
+        Inputs
+        ------
+        out : file object
+            Opened in binary mode, e.g. a temporary file
+        user_name : str
+            Only the rows of this user are exported
+        table : str
+            f_transactions or f_assets
+        file_format : str
+            'parquet', or 'csv' for a gzip compressed CSV
+        date_from : datetime.date
+            First included KeyDate, or None for no lower bound
+        date_to : datetime.date
+            Last included KeyDate, or None for no upper bound
+
+        Returns
+        -------
+        stats : dict
+            Number of exported rows and chunks, written bytes, and seconds
+        '''
+        if table not in _SCHEMAS:
+            raise ValueError(f'Unknown table {table}, expected one of {self.get_tables()}')
+        if file_format not in ('parquet', 'csv'):
+            raise ValueError(f"Unknown file format {file_format}, expected 'parquet' or 'csv'")
+
+        start = time.perf_counter()
+        offset = out.tell()
+        sql = f'''
+        SELECT
+            *
+        FROM
+            {self.__client._dataset}.{table}
+        WHERE
+            KeyUser = ?
+            AND KeyDate BETWEEN ? AND ?
+        ORDER BY
+            KeyDate
+        '''
+        params = (
+            user_name,
+            date_from.strftime('%Y-%m-%d') if date_from is not None else _MIN_DATE,
+            date_to.strftime('%Y-%m-%d') if date_to is not None else _MAX_DATE,
+        )
+        chunks = self.__client.iter_query_chunks(sql, params, chunk_size=self.__chunk_size)
+
+        if file_format == 'parquet':
+            rows, n_chunks = self.__write_parquet(out, chunks, _SCHEMAS[table])
+        else:
+            rows, n_chunks = self.__write_csv(out, chunks, _SCHEMAS[table])
+
+        return {'rows': rows, 'chunks': n_chunks, 'bytes': out.tell() - offset, 'seconds': time.perf_counter() - start}
+
+
+    def __write_parquet(self, out, chunks, schema: pa.Schema) -> tuple:
+        rows, n_chunks = 0, 0
+        with pq.ParquetWriter(out, schema, compression='zstd') as writer: # One row group per chunk
+            for df in chunks:
+                if df.shape[0] > 0:
+                    writer.write_table(pa.Table.from_pandas(self.__to_types(df, schema), schema=schema, preserve_index=False))
+                    rows += df.shape[0]
+                    n_chunks += 1
+        return rows, n_chunks
+
+
+    def __write_csv(self, out, chunks, schema: pa.Schema) -> tuple:
+        rows, n_chunks = 0, 0
+        with gzip.GzipFile(fileobj=out, mode='wb') as gz:
+            for df in chunks:
+                df = df[schema.names]
+                df.to_csv(gz, header=n_chunks == 0, index=False) # The header only once
+                rows += df.shape[0]
+                n_chunks += 1
+        return rows, n_chunks
+
+
+    def __to_types(self, df: pd.DataFrame, schema: pa.Schema) -> pd.DataFrame:
+        # SQLite returns the dates and timestamps as ISO strings
+        df = df[schema.names].copy()
+        df['KeyDate'] = pd.to_datetime(df['KeyDate'], format='ISO8601', errors='coerce').dt.date
+        df['CommitTimestamp'] = pd.to_datetime(df['CommitTimestamp'], format='ISO8601', utc=True, errors='coerce')
+        return df
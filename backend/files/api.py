@@ -1,13 +1,21 @@
 import pandas as pd
+import numpy as np
 import chardet
 import csv
-from backend.google_cloud.api import GoogleCloudAPI
+from backend.google_cloud.api import GoogleCloudAPI, transaction_fingerprints
 from backend.categories.api import CategoriesAPI
 from .data_collector import DataCollector
+from .filetype_registry import filetype_registry
+from .coding_registry import coding_registry
 
 class FilesAPI(GoogleCloudAPI):
     def __init__(self):
         self.__client = GoogleCloudAPI()
+        self.__categories = CategoriesAPI()
+        self.__last_commit_stats = {}
+        self.__last_committed_transactions = [] # The inserted rows of each file of the latest commit
+        self.__sample_size = 64 * 1024 # Bytes used to detect the encoding and the separator
+        self.__pending_codings = {} # {ColumnNameString: (fingerprint, encoding, separator)} of the parsed unknown filetypes
 
 
     def open_binary_as_pandas(self, input_file) -> pd.DataFrame:
@@ -21,9 +29,68 @@ class FilesAPI(GoogleCloudAPI):
         input_file : Streamlit BytesIO
             User provided file, that is validate to be a csv
         '''
-        encoding, separator = self.__autodetect_file_coding(input_file)
-        df = pd.read_csv(input_file, encoding=encoding, sep=separator)
-        return df
+        def parse(encoding: str, separator: str) -> pd.DataFrame:
+            input_file.seek(0)
+            return pd.read_csv(input_file, encoding=encoding, sep=separator)
+
+        return self.__parse_with_coding(input_file, parse)
+    
+
+    def iter_binary_as_pandas(self, input_file, chunksize: int = 50000):
+        ''' Open provided unkown CSV in chunks.
+        
+        Same as open_binary_as_pandas, but the file is parsed lazily,
+        and large files never have to fit in memory as a whole.
+
+        Inputs
+        ------
+        input_file : BytesIO, or a binary file object
+            User provided file, that is validate to be a csv
+        chunksize : int
+            Maximum number of rows in one chunk
+
+        Yields
+        ------
+        df : pd.DataFrame
+            The next chunk of the file, with the original columns
+        '''
+        readers = []
+        def parse(encoding: str, separator: str) -> pd.DataFrame:
+            input_file.seek(0)
+            readers.append(pd.read_csv(input_file, encoding=encoding, sep=separator, chunksize=chunksize))
+            return next(readers[-1]) # The coding is validated with the first chunk
+
+        try:
+            yield self.__parse_with_coding(input_file, parse)
+            yield from readers[-1]
+        finally:
+            for reader in readers:
+                reader.close()
+
+
+    def iter_transformed_input_file(self, input_file, chunksize: int = 50000):
+        ''' Open, and transform a known CSV in chunks.
+
+        The file type is identified from the first chunk only.
+        Note, the rows are sorted only inside each chunk.
+
+        Inputs
+        ------
+        input_file : BytesIO, or a binary file object
+            User provided file, that is validate to be a csv
+        chunksize : int
+            Maximum number of rows in one chunk
+
+        Yields
+        ------
+        df : pd.DataFrame
+            The next chunk in the format of transform_input_file
+        '''
+        filetype = None
+        for df in self.iter_binary_as_pandas(input_file, chunksize=chunksize):
+            if filetype is None:
+                filetype = self.__require_filetype(df) # Fails before any chunk is transformed
+            yield self.__transform_with_filetype(df, filetype)
     
 
     def add_filetype_to_databases(self, **kwargs) -> bool:
@@ -40,13 +107,19 @@ class FilesAPI(GoogleCloudAPI):
         '''
         kwargs['ColumnNameString'] = ','.join(kwargs['ColumnNameString'])
         self.__client.write_rows_to_table([kwargs], 'd_filetypes')
+        filetype_registry.invalidate()
+
+        pending = self.__pending_codings.pop(kwargs['ColumnNameString'], None)
+        if pending is not None: # The file that the filetype was made from
+            coding_registry.remember(*pending, kwargs['KeyFileName'])
 
 
     def add_transactions_to_database(self, df: pd.DataFrame, user_name: str) -> bool:
         ''' Push one Banking file to database.
         
-        The table is created, if not already exist.
         Ether the whoele df is uploaded, or it fails completely.
+        The whole file must be given, since the rows are identified by their
+        occurrence ordinal within the file, see filter_new_transactions().
 
         Inputs
         ------
@@ -55,15 +128,76 @@ class FilesAPI(GoogleCloudAPI):
         user_name: str
             The current active user
         '''
-        df['Category'] = df['Category'].fillna('N/A') # Different missing values can have multiple values: Nan, Empty, etc. Which is a challenge for reporting, thus, 'N/A' is selected to handle this
-        df['KeyUser'] = user_name
-        df['CommitTimestamp'] = pd.Timestamp('now', tz='Europe/Helsinki')
-        df = df[['KeyDate', 'KeyUser', 'Amount', 'Receiver', 'Category', 'CommitTimestamp']]
-        try:
-            self.__client.write_pandas_to_table(df, 'f_transactions')
-        except:
+        return self.add_transaction_files_to_database([df], user_name)
+    
+
+    def add_transaction_files_to_database(self, dfs: list, user_name: str) -> bool:
+        ''' Push multiple Banking files to database in a single transaction.
+
+        Rows that are already in the database are skipped, thus, overlapping 
+        files can be uploaded safely. The new rows and their fingerprints are 
+        bulk inserted, and either all files are uploaded, or none of them. 
+        The throughput, and the number of skipped rows are available from get_last_commit_stats(),
+        and the inserted rows from get_last_committed_transactions().
+
+        Inputs
+        ------
+        dfs: list[pd.DataFrame]
+            The Banking Files
+        user_name: str
+            The current active user
+        '''
+        timestamp = pd.Timestamp('now', tz='Europe/Helsinki')
+        frames = []
+        fingerprint_frames = []
+        committed = []
+        for df, (new, fingerprints) in zip(dfs, self.__new_rows(dfs, user_name)):
+            committed.append(df.loc[new])
+            df = self.__prepare_transactions(df.loc[new].copy(), user_name, timestamp)
+            frames.append(('f_transactions', df))
+            fingerprint_frames.append(('f_transaction_fingerprints', pd.DataFrame({'KeyUser': user_name, 'KeyDate': df['KeyDate'], 'Fingerprint': fingerprints[new]})))
+
+        if not self.__bulk_commit(frames + fingerprint_frames): # Committed in the same transaction
             return False
+        stats = self.__last_commit_stats
+        stats['rows'] = sum(df.shape[0] for _, df in frames) # Only the transactions
+        stats['skipped'] = sum(len(df) for df in dfs) - stats['rows']
+        stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] > 0 else float('inf')
+        self.__last_committed_transactions = committed
         return True
+
+
+    def filter_new_transactions(self, df: pd.DataFrame, user_name: str) -> pd.DataFrame:
+        ''' Returns the rows of the Banking file, that are not yet in the database.
+
+        The rows are identified by a hash of the date, amount, receiver, and the 
+        occurrence ordinal of the same values, thus, repeated transactions on the same day are kept.
+        The result is only a preview, always commit the whole file, since the 
+        ordinals of a subset do not match the ordinals of the whole file.
+
+        Inputs
+        ------
+        df: pd.DataFrame
+            The Banking File, in the format of transform_input_file
+        user_name: str
+            The current active user
+        '''
+        new, _ = self.__new_rows([df], user_name)[0]
+        return df.loc[new]
+    
+
+    def get_last_commit_stats(self) -> dict:
+        ''' Returns the rows, seconds, and rows per second of the latest successful commit.
+        For transactions, also the number of skipped already existing rows
+        '''
+        return self.__last_commit_stats
+
+
+    def get_last_committed_transactions(self) -> list:
+        ''' Returns the rows of each file, that were inserted by the latest successful 
+        transaction commit, in the original format. The skipped rows are excluded.
+        '''
+        return self.__last_committed_transactions
     
 
     def add_assets_to_database(self, date, user_name, collector) -> bool:
@@ -94,11 +228,7 @@ class FilesAPI(GoogleCloudAPI):
         df['KeyUser'] = user_name
         df['CommitTimestamp'] = pd.Timestamp('now', tz='Europe/Helsinki')
 
-        try:
-            self.__client.write_pandas_to_table(df, 'f_assets')
-        except:
-            return False
-        return True
+        return self.__bulk_commit([('f_assets', df)])
     
 
     def get_asset_data_collector(self):
@@ -109,7 +239,7 @@ class FilesAPI(GoogleCloudAPI):
         -------
         DataCollector() with Asset-categories
         '''
-        assets = CategoriesAPI().get_asset_categories()
+        assets = self.__categories.get_asset_categories()
         assets = [asset.replace('-', '_').lower() for asset in assets] # ASSETS-ARE-IN-THIS-FORMAT, and must_formatted_for_python
         collector = DataCollector()
         collector.add_from_list(assets)
@@ -133,9 +263,9 @@ class FilesAPI(GoogleCloudAPI):
         FROM
             {self.__client._dataset}.f_transactions
         WHERE
-            KeyUser = '{user_name}'
+            KeyUser = ?
         '''
-        latest_date = self.__client.sql_to_pandas(sql)['date'][0]
+        latest_date = self.__client.query_rows(sql, (user_name,))[0][0]
         return (latest_date is None) or (date > pd.to_datetime(latest_date, format='%Y-%m-%d').date()) # If there is data, validate
     
 
@@ -156,9 +286,9 @@ class FilesAPI(GoogleCloudAPI):
         FROM
             {self.__client._dataset}.f_assets
         WHERE
-            KeyUser = '{user_name}'
+            KeyUser = ?
         '''
-        latest_date = self.__client.sql_to_pandas(sql)['date'][0]
+        latest_date = self.__client.query_rows(sql, (user_name,))[0][0]
         return (latest_date is None) or (date > pd.to_datetime(latest_date, format='%Y-%m-%d').date()) # If there is data, validate
 
     
@@ -174,18 +304,28 @@ class FilesAPI(GoogleCloudAPI):
         df: pd.DataFrame
             The user input csv file 
         '''
+        filetype = self.__require_filetype(df)
+        return self.__transform_with_filetype(df, filetype)
+    
+
+    def __get_filetype(self, df: pd.DataFrame) -> dict:
+        ''' Returns the recorded d_filetypes row of the file, or None if unknown
+        '''
         cols = df.columns.to_list()
         col_str = ','.join(cols)
-        sql=f"""
-        SELECT
-            *
-        FROM
-            `{self.__client._dataset}.d_filetypes`
-        WHERE
-            ColumnNameString = '{col_str}'
-        """
-        filetype = self.__client.sql_to_pandas(sql).iloc[0].to_dict()
+        return filetype_registry.get(col_str)
+
+
+    def __require_filetype(self, df: pd.DataFrame) -> dict:
+        ''' Returns the recorded d_filetypes row of the file, or raises a ValueError if unknown
+        '''
+        filetype = self.__get_filetype(df)
+        if filetype is None:
+            raise ValueError(f"Unknown filetype with the columns {','.join(map(str, df.columns))}, add the filetype from the app first")
+        return filetype
+    
 
+    def __transform_with_filetype(self, df: pd.DataFrame, filetype: dict) -> pd.DataFrame:
         df.rename(columns={filetype['DateColumn']: 'KeyDate', filetype['ReceiverColumn']: 'Receiver', filetype['AmountColumn']: 'Amount'}, inplace=True)
 
         df['KeyDate'] = pd.to_datetime(df['KeyDate'], format=filetype['DateColumnFormat']).dt.date
@@ -200,37 +340,142 @@ class FilesAPI(GoogleCloudAPI):
 
     def filetype_is_in_database(self, df: pd.DataFrame) -> bool:
         ''' Checks whether the file type is known
+
+        The lookup is served from the in-memory filetype registry
         
         Inputs
         ------
         df: pd.DataFrame
             The user input csv file 
         '''
-        cols = df.columns.to_list()
-        col_str = ','.join(cols)
-        sql = f"""
+        return self.__get_filetype(df) is not None
+
+
+    def __prepare_transactions(self, df: pd.DataFrame, user_name: str, timestamp: pd.Timestamp) -> pd.DataFrame:
+        df['Category'] = df['Category'].fillna('N/A') # Different missing values can have multiple values: Nan, Empty, etc. Which is a challenge for reporting, thus, 'N/A' is selected to handle this
+        df['KeyUser'] = user_name
+        df['CommitTimestamp'] = timestamp
+        return df[['KeyDate', 'KeyUser', 'Amount', 'Receiver', 'Category', 'CommitTimestamp']]
+    
+
+    def __new_rows(self, dfs: list, user_name: str) -> list:
+        ''' Finds the rows of each file, that are not in the database, or in the previous files.
+
+        The fingerprints of the user are read only for the date range of each file,
+        and the whole file is checked with a single set membership pass.
+
+        Returns
+        -------
+        rows : list[tuple[np.array, np.array]]
+            The (new row mask, fingerprints) of each file
+        '''
+        sql = f'''
         SELECT
-            COUNT(*) AS count
+            Fingerprint
         FROM
-            `{self.__client._dataset}.d_filetypes`
+            {self.__client._dataset}.f_transaction_fingerprints
         WHERE
-            ColumnNameString = '{col_str}'
-        """
-        df = self.__client.sql_to_pandas(sql)
-        return df['count'].all() > 0
+            KeyUser = ?
+            AND KeyDate BETWEEN ? AND ?
+        '''
+        batch = set() # Fingerprints of the new rows of the previous files
+        rows = []
+        for df in dfs:
+            fingerprints = np.array(transaction_fingerprints(df), dtype=object)
+            if fingerprints.shape[0] == 0:
+                rows.append((np.zeros(0, dtype=bool), fingerprints))
+                continue
+
+            dates = pd.to_datetime(df['KeyDate'])
+            known = {row[0] for row in self.__client.query_rows(sql, (user_name, dates.min().strftime('%Y-%m-%d'), dates.max().strftime('%Y-%m-%d')))}
+            known.update(batch)
+            new = ~pd.Series(fingerprints).isin(known).to_numpy()
+            batch.update(fingerprints[new])
+            rows.append((new, fingerprints))
+        return rows
+
+
+    def __bulk_commit(self, frames: list) -> bool:
+        try:
+            self.__last_commit_stats = self.__client.bulk_write_pandas_to_tables(frames)
+        except Exception:
+            return False # The transaction was rolled back, nothing was written
+        return True
+
+
+    def __parse_with_coding(self, input_file, parse) -> pd.DataFrame:
+        ''' Parses the file with the remembered coding of its header, or with the detected one.
+
+        The remembered coding is replaced, if it fails to parse the file, or 
+        the columns are not a known filetype (e.g. one wide column of a wrong separator).
+
+        Inputs
+        ------
+        input_file : BytesIO, or a binary file object
+            User provided file, that is validate to be a csv
+        parse : callable
+            parse(encoding, separator) parses the file from the start, and returns the (first) DataFrame
+        '''
+        encoding, separator, fingerprint, is_known = self.__file_coding(input_file)
+        if is_known:
+            try:
+                df = parse(encoding, separator)
+                if self.__get_filetype(df) is not None:
+                    return df
+            except (UnicodeDecodeError, pd.errors.ParserError):
+                pass
+            coding_registry.forget(fingerprint) # The remembered coding does not fit this file
+            encoding, separator = self.__autodetect_file_coding(self.__read_sample(input_file))
+
+        df = parse(encoding, separator)
+        self.__remember_coding(df, fingerprint, encoding, separator)
+        return df
+
 
+    def __file_coding(self, file_binary):
+        ''' Returns the remembered coding of the file header, or detects it.
 
-    def __autodetect_file_coding(self, file_binary) -> str:
+        Returns
+        -------
+        encoding : str
+        separator : str
+        fingerprint : str
+            Hash of the raw header line
+        is_known : bool
+            True, if the coding was remembered, and the detection was skipped
+        '''
+        sample = self.__read_sample(file_binary)
+        fingerprint = coding_registry.fingerprint(sample)
+        coding = coding_registry.get(fingerprint)
+        if coding is not None:
+            return coding[0], coding[1], fingerprint, True
+        encoding, separator = self.__autodetect_file_coding(sample)
+        return encoding, separator, fingerprint, False
+
+
+    def __remember_coding(self, df: pd.DataFrame, fingerprint: str, encoding: str, separator: str):
+        ''' Remembers the coding, if the parsed columns are a known filetype,
+        otherwise, until the filetype is added
+        '''
+        filetype = self.__get_filetype(df)
+        if filetype is not None:
+            coding_registry.remember(fingerprint, encoding, separator, filetype['KeyFileName'])
+        else:
+            self.__pending_codings[','.join(df.columns.to_list())] = (fingerprint, encoding, separator)
+
+
+    def __autodetect_file_coding(self, sample: bytes) -> str:
         ''' 
         Auto detects used encoding and separator in csv file.
 
         If file parameters are unkwown, it has to be first opened in binary
-        to avoid any parsing errors.
+        to avoid any parsing errors. Only a bounded prefix of the file is used,
+        thus, the detection cost does not grow with the file size.
 
         Parameters
         ----------
-        file_binary : A subclass of BytesIO
-            The raw input file from Streamlit File Uploader
+        sample : bytes
+            The first bytes of the raw input file, see __read_sample()
 
         Returns
         -------
@@ -239,11 +484,25 @@ class FilesAPI(GoogleCloudAPI):
         separator : str
             Detected separator in [',', ';', '', '\t', '|']
         '''
-        encoding_dict = chardet.detect(file_binary.getvalue())
+        encoding_dict = chardet.detect(sample)
         encoding = encoding_dict['encoding']
+        if encoding is None or encoding == 'ascii': # The rest of the file may have non-ascii characters, and utf-8 is a superset
+            encoding = 'utf-8'
 
-        dialect = csv.Sniffer().sniff(file_binary.getvalue().decode(encoding), delimiters=[',', ';', '', '\t', '|'])
+        text = sample.decode(encoding, errors='ignore')
+        if len(sample) == self.__sample_size:
+            text = text[:text.rfind('\n') + 1] or text # Do not sniff a partial last line
+        dialect = csv.Sniffer().sniff(text, delimiters=[',', ';', '', '\t', '|'])
         separator = dialect.delimiter
 
         return encoding, separator
     
+
+    def __read_sample(self, file_binary) -> bytes:
+        ''' Reads a bounded prefix of the file, and rewinds it for the actual parsing
+        '''
+        file_binary.seek(0)
+        sample = file_binary.read(self.__sample_size)
+        file_binary.seek(0)
+        return sample
+    
@@ -0,0 +1,172 @@
+''' Headless ingestion of a directory of banking files.
+
+Usage
+-----
+    python -m backend.files.backfill statements/ --user my_user --workers 4
+
+The files are parsed, transformed and categorized in parallel processes,
+and the transactions are committed in bulk by the main process.
+The files must be of a known filetype, add new filetypes from the app first.
+As in the app, the rows that are already committed are skipped, 
+thus, overlapping exports can be ingested safely.
+'''
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from backend.google_cloud.api import GoogleCloudAPI
+from backend.files.api import FilesAPI
+from backend.ml.api import MLAPI
+from backend.ml.receiver_memo import receiver_memo
+
+
+_files = None # The APIs of a worker process
+_ml = None
+
+
+def _init_worker(predict: bool, memo_table):
+    global _files, _ml
+    _files = FilesAPI()
+    _ml = MLAPI()
+    if predict:
+        receiver_memo.pin(memo_table) # Built once by the parent, the workers never refresh the training set
+        _ml.load_model_from_gcs() # Memory mapped once per process
+
+
+def _process_file(path: str, min_confidence: float, chunk_size: int) -> dict:
+    ''' Parses, transforms and categorizes one file in a worker process
+
+    The file is read and categorized in chunks, thus, the raw columns and the
+    prediction intermediates of a large file are never in memory at once.
+    The chunks are joined again, since a file is committed as a whole.
+
+    Returns
+    -------
+    result : dict
+        The transactions as 'df', or the 'error' message, and the timings of the stages
+    '''
+    result = {'path': path, 'bytes': os.path.getsize(path), 'df': None, 'error': None}
+    try:
+        start = time.perf_counter()
+        chunks = []
+        predict_seconds = 0.0
+        with open(path, 'rb') as f:
+            for df in _files.iter_transformed_input_file(f, chunksize=chunk_size): # Raises a ValueError for an unknown filetype
+                predict_start = time.perf_counter()
+                if _ml.has_model() and df.shape[0] > 0:
+                    categories, probs = _ml.predict(df)
+                    df['Category'] = [category if prob >= min_confidence else None for category, prob in zip(categories, probs)] # Uncertain rows are left for a manual review
+                predict_seconds += time.perf_counter() - predict_start
+                chunks.append(df)
+        df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+        df.sort_values(by='KeyDate', ascending=True, kind='stable', inplace=True) # The chunks are sorted only internally
+        result['parse_seconds'] = time.perf_counter() - start - predict_seconds
+        result['predict_seconds'] = predict_seconds
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+        return result
+
+    result['df'] = df
+    return result
+
+
+def backfill(paths: list, user_name: str, workers: int = None, predict: bool = True, min_confidence: float = 0.0,
+             batch_files: int = 50, chunk_size: int = 50000, out=sys.stdout) -> dict:
+    ''' Ingests the files, and prints the throughput of each file.
+
+    Inputs
+    ------
+    paths : list
+        CSV files to ingest
+    user_name : str
+        Owner of the transactions
+    workers : int
+        Number of parsing processes, defaults to the number of CPUs
+    predict : bool
+        Categorize the rows with the saved model, otherwise the categories are left empty
+    min_confidence : float
+        Predictions below this propability are left empty
+    batch_files : int
+        Number of files committed in one transaction
+    chunk_size : int
+        Number of rows parsed and categorized at once in a worker
+
+    Returns
+    -------
+    summary : dict
+        Number of committed, failed and empty files, committed and skipped rows, and total seconds
+    '''
+    start = time.perf_counter()
+    GoogleCloudAPI() # Create and migrate the database once, before the workers open it
+    files = FilesAPI()
+    summary = {'files': 0, 'skipped': 0, 'failed': 0, 'empty': 0, 'rows': 0, 'seconds': 0.0}
+
+    memo_table = receiver_memo.get_table() if predict else None
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(predict, memo_table)) as pool:
+        results = list(pool.map(_process_file, paths, [min_confidence] * len(paths), [chunk_size] * len(paths)))
+
+    parsed = []
+    for result in results:
+        if result['error'] is not None:
+            summary['failed'] += 1
+            print(f"FAILED   {result['path']}: {result['error']}", file=out)
+            continue
+        if result['df'].shape[0] == 0: # e.g. a statement of a month without transactions
+            summary['empty'] += 1
+            print(f"EMPTY    {result['path']}: no rows", file=out)
+            continue
+        parsed.append(result)
+    parsed.sort(key=lambda result: result['df']['KeyDate'].min()) # Oldest statements first
+
+    for result in parsed:
+        df = result['df']
+        seconds = result['parse_seconds'] + result['predict_seconds']
+        print(f"PARSED   {result['path']}: {df.shape[0]} rows, {result['bytes'] / 1e6:.2f} MB, "
+              f"parse {result['parse_seconds']:.3f}s, predict {result['predict_seconds']:.3f}s, {df.shape[0] / max(seconds, 1e-9):.0f} rows/s", file=out)
+
+    for i in range(0, len(parsed), batch_files):
+        batch = parsed[i:i + batch_files]
+        if not files.add_transaction_files_to_database([result['df'] for result in batch], user_name):
+            summary['failed'] += len(batch)
+            print(f'FAILED   commit of {len(batch)} files, the batch was rolled back', file=out)
+            continue
+        stats = files.get_last_commit_stats()
+        summary['files'] += len(batch)
+        summary['rows'] += stats['rows']
+        summary['skipped'] += stats['skipped']
+        print(f"COMMITTED {len(batch)} files: {stats['rows']} new rows in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/s), "
+              f"{stats['skipped']} existing rows skipped", file=out)
+
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ingest a directory of banking files')
+    parser.add_argument('directory', help='Directory of the banking files')
+    parser.add_argument('--user', required=True, help='Owner of the transactions')
+    parser.add_argument('--pattern', default='*.csv', help='Glob pattern of the files, searched recursively')
+    parser.add_argument('--workers', type=int, default=None, help='Number of parsing processes')
+    parser.add_argument('--no-predict', action='store_true', help='Do not categorize the rows')
+    parser.add_argument('--min-confidence', type=float, default=0.0, help='Leave the predictions below this propability empty')
+    parser.add_argument('--batch-files', type=int, default=50, help='Number of files committed in one transaction')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='Number of rows parsed and categorized at once')
+    args = parser.parse_args(argv)
+
+    paths = sorted(glob.glob(os.path.join(args.directory, '**', args.pattern), recursive=True))
+    if len(paths) == 0:
+        print(f'No files matching {args.pattern} in {args.directory}', file=sys.stderr)
+        return 1
+
+    summary = backfill(paths, args.user, workers=args.workers, predict=not args.no_predict, min_confidence=args.min_confidence,
+                       batch_files=args.batch_files, chunk_size=args.chunk_size)
+    print(f"Done: {summary['files']} files, {summary['rows']} rows committed, {summary['skipped']} existing rows skipped, "
+          f"{summary['failed']} failed, {summary['empty']} empty in {summary['seconds']:.2f}s ({summary['rows'] / max(summary['seconds'], 1e-9):.0f} rows/s)")
+    return 0 if summary['failed'] == 0 else 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import hashlib
+import threading
+from backend.google_cloud.api import GoogleCloudAPI
+
+
+class CodingRegistry():
+    ''' Process-wide in-memory copy of the d_filetype_codings table.
+
+    The banks export the same formats every month, with identical header lines,
+    thus, the text encoding and the separator of a file are remembered by a
+    fingerprint of the raw header bytes. Only the codings that produced
+    the columns of a known filetype are remembered, and a hit skips
+    the statistical detection completely. A coding that fails to parse a file,
+    or does not produce the columns of a known filetype, is forgotten, and the 
+    detected coding is remembered instead.
+    '''
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__codings = None # {HeaderHash: (Encoding, Separator)}, None if not loaded
+        self.__version = 0
+        self.__hits = 0
+        self.__misses = 0
+
+
+    @staticmethod
+    def fingerprint(sample: bytes) -> str:
+        ''' Hash of the raw first line bytes of the file
+
+        Inputs
+        ------
+        sample : bytes
+            A prefix of the file, that contains at least the first line
+        '''
+        end = sample.find(b'\n')
+        header = sample[:end + 1] if end != -1 else sample
+        return hashlib.sha256(header).hexdigest()
+
+
+    def get(self, fingerprint: str) -> tuple:
+        ''' Returns the remembered (encoding, separator), or None if the header is unseen
+        '''
+        codings = self.__codings
+        if codings is None:
+            codings = self.__load()
+        coding = codings.get(fingerprint)
+        with self.__lock:
+            if coding is None:
+                self.__misses += 1
+            else:
+                self.__hits += 1
+        return coding
+
+
+    def remember(self, fingerprint: str, encoding: str, separator: str, file_name: str) -> bool:
+        ''' Persist the confirmed coding of a header
+
+        Inputs
+        ------
+        fingerprint : str
+            Output of fingerprint()
+        encoding : str
+            Text encoding that the file was parsed with
+        separator : str
+            Column separator that the file was parsed with
+        file_name : str
+            The KeyFileName of the matching filetype
+        '''
+        codings = self.__codings
+        if codings is None:
+            codings = self.__load()
+        if fingerprint in codings:
+            return False
+        row = {'HeaderHash': fingerprint, 'Encoding': encoding, 'Separator': separator, 'KeyFileName': file_name}
+        written = GoogleCloudAPI().write_rows_to_table([row], 'd_filetype_codings') # Fails on the unique index, if another session was faster
+        with self.__lock:
+            if self.__codings is not None:
+                self.__codings[fingerprint] = (encoding, separator)
+        return written
+
+
+    def forget(self, fingerprint: str) -> bool:
+        ''' Remove a coding, that did not fit a file with the header anymore
+        '''
+        removed = GoogleCloudAPI().delete_rows_from_table('d_filetype_codings', 'HeaderHash', fingerprint)
+        with self.__lock:
+            if self.__codings is not None:
+                self.__codings.pop(fingerprint, None)
+        return removed
+
+
+    def invalidate(self):
+        ''' Drop the loaded codings, and reload on the next lookup
+        '''
+        with self.__lock:
+            self.__codings = None
+            self.__version += 1
+
+
+    def stats(self) -> dict:
+        with self.__lock:
+            calls = self.__hits + self.__misses
+            return {
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'hit_rate': self.__hits / calls if calls > 0 else 0.0,
+                'size': len(self.__codings) if self.__codings is not None else 0
+            }
+
+
+    @property
+    def version(self) -> int:
+        return self.__version
+
+
+    def __load(self) -> dict:
+        with self.__lock:
+            if self.__codings is None:
+                client = GoogleCloudAPI()
+                sql = f"""
+                SELECT
+                    HeaderHash,
+                    Encoding,
+                    Separator
+                FROM
+                    `{client._dataset}.d_filetype_codings`
+                """
+                rows = client.query_rows(sql)
+                self.__codings = {header_hash: (encoding, separator) for header_hash, encoding, separator in rows}
+            return self.__codings
+
+
+coding_registry = CodingRegistry()
@@ -0,0 +1,72 @@
+import threading
+from backend.google_cloud.api import GoogleCloudAPI
+
+
+class FiletypeRegistry():
+    ''' Process-wide in-memory copy of the d_filetypes table.
+
+    All known filetypes are loaded once into a dict keyed by the 
+    ColumnNameString signature, thus, identifying a file is a single
+    dict lookup without a database round trip.
+    The registry must be invalidated, when a new filetype is added.
+    '''
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__filetypes = None # {ColumnNameString: d_filetypes row}, None if not loaded
+        self.__version = 0
+
+
+    def get(self, signature: str) -> dict:
+        ''' Returns the d_filetypes row of the signature
+
+        Inputs
+        ------
+        signature : str
+            The comma joined column names of the file
+
+        Returns
+        -------
+        filetype : dict
+            The row as a dict, or None if the filetype is unknown
+        '''
+        filetypes = self.__filetypes
+        if filetypes is None:
+            filetypes = self.__load()
+        return filetypes.get(signature)
+
+
+    def invalidate(self):
+        ''' Drop the loaded filetypes, and reload on the next lookup
+        '''
+        with self.__lock:
+            self.__filetypes = None
+            self.__version += 1
+
+
+    @property
+    def version(self) -> int:
+        return self.__version
+
+
+    def __load(self) -> dict:
+        with self.__lock:
+            if self.__filetypes is None:
+                client = GoogleCloudAPI()
+                sql = f"""
+                SELECT
+                    *
+                FROM
+                    `{client._dataset}.d_filetypes`
+                ORDER BY
+                    rowid
+                """
+                df = client.sql_to_pandas(sql)
+                filetypes = {}
+                for row in df.to_dict('records'):
+                    filetypes.setdefault(row['ColumnNameString'], row) # The first added row wins, if a filetype was added twice
+                self.__filetypes = filetypes
+            return self.__filetypes
+
+
+filetype_registry = FiletypeRegistry()
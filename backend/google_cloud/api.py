@@ -1,10 +1,226 @@
 import sqlite3
+import os
 import os.path
+import threading
+import atexit
+import time
+import datetime
+import functools
+import hashlib
 import pandas as pd
 import json
 
 
 
+class ConnectionPool():
+    ''' Per-thread pool of persistent SQLite connections
+
+    Streamlit runs every session in its own thread, and opening
+    a new connection for every query leaks file descriptors and pays
+    the connect and schema-parse cost each time. The pool keeps one
+    connection per (thread, database) pair, and reuses it across calls.
+    Connections of finished threads are closed lazily on the next miss.
+    A forked child process starts with an empty pool, since an SQLite 
+    connection must not be used across fork().
+    '''
+
+    def __init__(self, busy_timeout: float = 30.0, cached_statements: int = 256):
+        self.__busy_timeout = busy_timeout
+        self.__cached_statements = cached_statements
+        self.__connections = {} # {(thread_ident, db_name): (thread, connection)}
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__inherited = [] # Connections of the parent process, kept referenced, so that those are never closed by the child
+        if hasattr(os, 'register_at_fork'): # Not available on Windows, which does not fork
+            os.register_at_fork(after_in_child=self.__forget_inherited)
+
+
+    def connection(self, db_name: str) -> sqlite3.Connection:
+        ''' Return the calling thread's connection to the database.
+
+        A new connection is opened only, if the thread does not have one yet.
+        
+        Inputs
+        ------
+        db_name : str
+            The path of the SQLite database file
+
+        Returns
+        -------
+        conn : sqlite3.Connection
+        '''
+        key = (threading.get_ident(), db_name)
+        with self.__lock:
+            entry = self.__connections.get(key)
+            if entry is not None and entry[0].is_alive():
+                self.__hits += 1
+                return entry[1]
+            self.__misses += 1
+            self.__reap_dead_threads()
+
+        conn = self.__connect(db_name)
+        with self.__lock:
+            self.__connections[key] = (threading.current_thread(), conn)
+        return conn
+
+
+    def close(self, db_name: str = None):
+        ''' Close all pooled connections, or only the ones to a given database.
+
+        Inputs
+        ------
+        db_name : str
+            If given, only the connections to this database are closed
+        '''
+        with self.__lock:
+            keys = [key for key in self.__connections if db_name is None or key[1] == db_name]
+            entries = [self.__connections.pop(key) for key in keys]
+        for _, conn in entries:
+            conn.close()
+
+
+    def stats(self) -> dict:
+        ''' Returns the pool usage counters
+        '''
+        with self.__lock:
+            return {
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'open_connections': len(self.__connections)
+            }
+
+
+    @property
+    def busy_timeout(self) -> float:
+        return self.__busy_timeout
+
+
+    def __connect(self, db_name: str) -> sqlite3.Connection:
+        # The connection is only used by the owning thread, 
+        # but it may be closed from an other thread on shutdown
+        conn = sqlite3.connect(db_name, timeout=self.__busy_timeout, check_same_thread=False, cached_statements=self.__cached_statements) # Compiled statements are reused by the SQL text
+        conn.execute(f'PRAGMA busy_timeout = {int(self.__busy_timeout * 1000)}')
+        conn.execute('PRAGMA journal_mode = WAL') # Readers do not block the writer, and vice versa
+        conn.execute('PRAGMA synchronous = NORMAL') # Durable in the WAL mode, without a sync on every commit
+        return conn
+
+
+    def __forget_inherited(self):
+        # Runs in the forked child, the lock may have been held by an other thread of the parent
+        self.__lock = threading.Lock()
+        self.__inherited.extend(conn for _, conn in self.__connections.values())
+        self.__connections = {}
+
+
+    def __reap_dead_threads(self):
+        # Must be called with the lock held
+        dead = [key for key, (thread, _) in self.__connections.items() if not thread.is_alive()]
+        for key in dead:
+            self.__connections.pop(key)[1].close()
+
+
+_pool = ConnectionPool()
+atexit.register(_pool.close)
+
+
+def transaction_fingerprints(df: pd.DataFrame) -> list:
+    ''' Content hashes of the transaction rows, that identify the same rows in overlapping files.
+
+    The hash is computed from the KeyDate, Amount, Receiver and the occurrence ordinal
+    of the same (KeyDate, Amount, Receiver) values, thus, genuinely repeated
+    transactions on the same day (e.g. two similar lunches) are kept apart.
+    The ordinal is counted in the order of the rows.
+
+    Inputs
+    ------
+    df : pd.DataFrame
+        Transactions of one user, with the KeyDate, Amount, and Receiver columns
+
+    Returns
+    -------
+    fingerprints : list[str]
+        32 character hex digest of each row
+    '''
+    keys = pd.DataFrame({
+        'date': pd.to_datetime(df['KeyDate']).dt.strftime('%Y-%m-%d').to_numpy(),
+        'amount': pd.Series(df['Amount'].to_numpy(dtype=float)).map('{:.2f}'.format).to_numpy(),
+        'receiver': df['Receiver'].fillna('').astype(str).to_numpy(),
+    })
+    keys['ordinal'] = keys.groupby(['date', 'amount', 'receiver'], sort=False).cumcount()
+    return [hashlib.blake2b(f'{date}|{amount}|{receiver}|{ordinal}'.encode('utf-8'), digest_size=16).hexdigest() 
+            for date, amount, receiver, ordinal in keys.itertuples(index=False, name=None)]
+
+
+def _backfill_transaction_fingerprints(conn: sqlite3.Connection):
+    # Fingerprints of the already committed transactions, in the commit order
+    df = pd.read_sql_query('SELECT KeyUser, KeyDate, Amount, Receiver FROM f_transactions ORDER BY rowid', conn)
+    for user_name, df_user in df.groupby('KeyUser', sort=False):
+        conn.executemany('INSERT INTO f_transaction_fingerprints (KeyUser, KeyDate, Fingerprint) VALUES (?, ?, ?)', 
+                         zip([user_name] * df_user.shape[0], df_user['KeyDate'], transaction_fingerprints(df_user)))
+
+
+# Schema migrations as (version, steps), applied in order on top of the initial schema.
+# A step is an SQL statement, or a callable of the connection for data migrations.
+# The current version is stored in the database file (PRAGMA user_version),
+# thus, existing databases are upgraded in place, and each migration runs only once.
+# Never modify an existing migration, append a new one instead.
+_MIGRATIONS = [
+    (1, [
+        'CREATE INDEX IF NOT EXISTS ix_f_transactions_user_date ON f_transactions (KeyUser, KeyDate)',
+        'CREATE INDEX IF NOT EXISTS ix_f_transactions_category ON f_transactions (Category)',
+        'CREATE INDEX IF NOT EXISTS ix_f_assets_user_date ON f_assets (KeyUser, KeyDate)',
+        'CREATE INDEX IF NOT EXISTS ix_d_filetypes_column_name_string ON d_filetypes (ColumnNameString)',
+    ]),
+    (2, [
+        # Confirmed text encodings and separators of the known file headers
+        '''CREATE TABLE IF NOT EXISTS d_filetype_codings (
+            HeaderHash CHAR(64),
+            Encoding CHAR(50),
+            Separator CHAR(5),
+            KeyFileName CHAR(50)
+        )''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_d_filetype_codings_header_hash ON d_filetype_codings (HeaderHash)',
+    ]),
+    (3, [
+        # Per-user content hashes of the committed transactions, used to skip the already committed rows
+        '''CREATE TABLE IF NOT EXISTS f_transaction_fingerprints (
+            KeyUser CHAR(50),
+            KeyDate DATE,
+            Fingerprint CHAR(32)
+        )''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_f_transaction_fingerprints_user_date ON f_transaction_fingerprints (KeyUser, KeyDate, Fingerprint)',
+        _backfill_transaction_fingerprints,
+    ]),
+    (4, [
+        # The training set is read with Category != ?, that can never use the index, which only costs on every insert
+        'DROP INDEX IF EXISTS ix_f_transactions_category',
+    ]),
+]
+
+# The hot queries of the application, used to verify that those are served by the indexes
+_HOT_QUERIES = {
+    'latest_transaction_date': 'SELECT MAX(KeyDate) AS date FROM f_transactions WHERE KeyUser = ?',
+    'latest_asset_date': 'SELECT MAX(KeyDate) AS date FROM f_assets WHERE KeyUser = ?',
+    'training_data': 'SELECT rowid AS row_id, KeyDate AS date, Receiver AS receiver, Amount AS amount, Category AS category, CommitTimestamp AS commit_timestamp FROM f_transactions WHERE rowid > ? AND Category != ?',
+    'training_watermark': 'SELECT CommitTimestamp FROM f_transactions WHERE rowid = ?',
+    'filetype': 'SELECT * FROM d_filetypes WHERE ColumnNameString = ?',
+    'transaction_fingerprints': 'SELECT Fingerprint FROM f_transaction_fingerprints WHERE KeyUser = ? AND KeyDate BETWEEN ? AND ?',
+    'export_transactions': 'SELECT * FROM f_transactions WHERE KeyUser = ? AND KeyDate BETWEEN ? AND ? ORDER BY KeyDate',
+    'export_assets': 'SELECT * FROM f_assets WHERE KeyUser = ? AND KeyDate BETWEEN ? AND ? ORDER BY KeyDate',
+}
+
+@functools.lru_cache(maxsize=1024)
+def _resolve_dataset(sql: str) -> str:
+    # Remove the `<dataset>.` part for SQLite, only once per distinct query text
+    return sql.replace("DATASET-FILLER.", "")
+
+
+_migrated = set() # Databases that are up to date in this process
+_migration_lock = threading.Lock()
+
+
+
 class GoogleCloudAPI():
     ''' Local Mock version of the actual GoogelCloudAPI
 
@@ -19,29 +235,92 @@ class GoogleCloudAPI():
         self.__db_name = 'my_finance.db'
         self._dataset = 'DATASET-FILLER' # Not used in sqlite
         if not os.path.isfile(self.__db_name): # Create the DB, if not already exists
+            _pool.close(self.__db_name) # Drop handles to a removed file
+            _migrated.discard(self.__db_name)
             self.__init_local_db()
+        if self.__db_name not in _migrated:
+            self.__migrate()
 
 
-    def sql_to_pandas(self, sql: str) -> pd.DataFrame:
+    def sql_to_pandas(self, sql: str, params: tuple = None) -> pd.DataFrame:
         ''' Run a regular SQL query 
         and return a pandas DataFrame.
+
+        User provided values must always be passed as parameters,
+        and never formatted into the query text.
         
         Inputs
         ------
         sql : string
-            A regular SQL query
+            A regular SQL query, with ? placeholders for the parameters
+        params : tuple
+            Values for the placeholders
 
         Returns
         -------
         df : DataFrame
         '''
-        # Remove the `<dataset>.` part for SQLite
-        sql = sql.replace("DATASET-FILLER.", "")
-        conn = sqlite3.connect(self.__db_name)
-        df = pd.read_sql_query(sql, conn)
+        df = pd.read_sql_query(_resolve_dataset(sql), self.__connection(), params=params)
         return df
     
 
+    def query_rows(self, sql: str, params: tuple = ()) -> list:
+        ''' Run a parameterized SQL query, and return the raw rows.
+
+        Lighter than sql_to_pandas for the small hot lookups. The query text is constant,
+        thus, its compiled statement is reused from the connection statement cache.
+        
+        Inputs
+        ------
+        sql : string
+            A regular SQL query, with ? placeholders for the parameters
+        params : tuple
+            Values for the placeholders
+
+        Returns
+        -------
+        rows : list[tuple]
+        '''
+        return self.__connection().execute(_resolve_dataset(sql), params).fetchall()
+
+
+    def iter_query_chunks(self, sql: str, params: tuple = (), chunk_size: int = 50000):
+        ''' Stream the result of a query in DataFrame chunks from a consistent snapshot.
+
+        The rows are read with a dedicated read-only connection inside a single
+        read transaction, thus, the commits made during the streaming are not seen,
+        and the writers are not blocked (WAL mode). Only one chunk is in memory at a time.
+
+        Inputs
+        ------
+        sql : string
+            A regular SQL query, with ? placeholders for the parameters
+        params : tuple
+            Values for the placeholders
+        chunk_size : int
+            Maximum number of rows in one chunk
+
+        Yields
+        ------
+        df : pd.DataFrame
+            The next chunk. An empty DataFrame with the columns, if there are no rows
+        '''
+        conn = sqlite3.connect(f'file:{self.__db_name}?mode=ro', uri=True, timeout=_pool.busy_timeout)
+        try:
+            conn.execute('BEGIN') # The snapshot is taken by the first read, and held until the end
+            cursor = conn.execute(_resolve_dataset(sql), params)
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                yield pd.DataFrame(columns=columns)
+            while rows:
+                yield pd.DataFrame.from_records(rows, columns=columns)
+                rows = cursor.fetchmany(chunk_size)
+        finally:
+            conn.rollback()
+            conn.close()
+    
+
     def write_pandas_to_table(self, df: pd.DataFrame, table: str):
         ''' Push a DataFrame to BigQuery.
 
@@ -57,8 +336,7 @@ class GoogleCloudAPI():
         table : str
             The name of destination Table, that is used together with initial project parameters
         '''
-        conn = sqlite3.connect(self.__db_name)
-        df.to_sql(name=table, con=conn, if_exists='append', index=False)
+        df.to_sql(name=table, con=self.__connection(), if_exists='append', index=False)
 
 
     def write_rows_to_table(self, rows_to_insert: list, table: str) -> bool:
@@ -78,8 +356,7 @@ class GoogleCloudAPI():
         success: bool
             If the insert operation results any errors, those a printed and False is returned
         '''
-        conn = sqlite3.connect(self.__db_name)
-        cursor = conn.cursor()
+        conn = self.__connection()
 
         columns = rows_to_insert[0].keys()
         
@@ -93,15 +370,81 @@ class GoogleCloudAPI():
         values = [tuple(row[col] for col in columns) for row in rows_to_insert]
         
         try:
-            cursor.executemany(query, values)
-            conn.commit()
+            with conn: # Commits, or rolls back on errors
+                conn.executemany(query, values)
         except Exception as e:
-            conn.close()
             return False
-        conn.close()
         return True
     
 
+    def delete_rows_from_table(self, table: str, key_column: str, key_value) -> bool:
+        ''' Delete the rows of an existing table, that have the given key value
+
+        Inputs
+        ------
+        table: str
+            The name of the Table, that is used together with initial project parameters
+        key_column : str
+            The column that identifies the rows
+        key_value
+            Rows with this value are deleted
+
+        Returns
+        -------
+        success: bool
+        '''
+        conn = self.__connection()
+        try:
+            with conn: # Commits, or rolls back on errors
+                conn.execute(f'DELETE FROM {table} WHERE {key_column} = ?', (key_value,))
+        except Exception as e:
+            return False
+        return True
+
+
+    def bulk_write_pandas_to_tables(self, frames: list) -> dict:
+        ''' Append multiple DataFrames to existing tables in a single transaction.
+
+        All rows are inserted with executemany inside one explicit transaction, 
+        thus, either all frames are written, or none of them.
+        The column names of each DataFrame must match the destination table.
+        
+        Inputs
+        ------
+        frames : list[tuple[str, pd.DataFrame]]
+            The (table, df) pairs to be written in the given order
+
+        Returns
+        -------
+        stats : dict
+            The number of written rows, seconds, and rows per second
+
+        Raises
+        ------
+        The original database error, after the transaction has been rolled back
+        '''
+        conn = self.__connection()
+        start = time.perf_counter()
+        rows = 0
+        try:
+            conn.execute('BEGIN IMMEDIATE') # Take the write lock up front, instead of failing mid-way
+            for table, df in frames:
+                columns = ', '.join(df.columns)
+                placeholders = ', '.join(['?'] * len(df.columns))
+                conn.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', self.__to_sql_rows(df))
+                rows += df.shape[0]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        seconds = time.perf_counter() - start
+        return {
+            'rows': rows,
+            'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds > 0 else float('inf')
+        }
+
+
     def upload_file_to_gcs(self, local_file_path: str):
         ''' Upload Local File to GCS
         
@@ -129,8 +472,132 @@ class GoogleCloudAPI():
         pass # The file is already in the local space
 
 
+    def schema_version(self) -> int:
+        ''' Returns the applied schema migration version of the database
+        '''
+        return self.__connection().execute('PRAGMA user_version').fetchone()[0]
+
+
+    def data_version(self) -> int:
+        ''' Returns the data version of the calling thread's connection.
+
+        The value changes, when any other connection (of any process) 
+        commits to the database, thus, the in-memory copies of the tables
+        can detect changes without reading the tables.
+        '''
+        return self.__connection().execute('PRAGMA data_version').fetchone()[0]
+
+
+    def explain_query_plan(self, sql: str, params: tuple = ()) -> pd.DataFrame:
+        ''' Returns the SQLite query plan of the query.
+
+        Inputs
+        ------
+        sql : str
+            A regular SQL query
+        params : tuple
+            Values for the ? placeholders, the values do not affect the plan
+
+        Returns
+        -------
+        df : DataFrame
+            The plan steps, the 'detail' column describes the table access
+        '''
+        rows = self.__connection().execute(f'EXPLAIN QUERY PLAN {_resolve_dataset(sql)}', params).fetchall()
+        return pd.DataFrame(rows, columns=['id', 'parent', 'notused', 'detail'])
+
+
+    def check_query_plans(self) -> pd.DataFrame:
+        ''' Explains all hot queries of the application.
+
+        Returns
+        -------
+        df : DataFrame
+            One row per query with the plan details, and whether the query
+            is served by an index, or a full table scan
+        '''
+        checks = []
+        for name, sql in _HOT_QUERIES.items():
+            plan = self.explain_query_plan(sql, ('',) * sql.count('?'))
+            details = plan['detail'].to_list()
+            full_scan = any(detail.startswith('SCAN') and 'INDEX' not in detail for detail in details)
+            checks.append({'query': name, 'plan': '; '.join(details), 'uses_index': not full_scan})
+        return pd.DataFrame(checks)
+
+
+    @staticmethod
+    def connection_pool_stats() -> dict:
+        ''' Returns the hit and miss counters of the shared connection pool
+        '''
+        return _pool.stats()
+
+
+    @staticmethod
+    def close_connections():
+        ''' Close all pooled connections.
+        
+        Must be called before the database file is removed,
+        otherwise the open handles keep pointing to the deleted file.
+        '''
+        _pool.close()
+
+
+    def __connection(self) -> sqlite3.Connection:
+        return _pool.connection(self.__db_name)
+    
+
+    def __to_sql_rows(self, df: pd.DataFrame):
+        ''' Convert the DataFrame into tuples of SQLite compatible values.
+
+        The values are stored in the same text format as pandas.to_sql uses, 
+        dates as ISO dates, and timestamps as ISO datetimes with a space separator.
+        '''
+        def iso_format(val):
+            if isinstance(val, pd.Timestamp):
+                val = val.to_pydatetime()
+            if isinstance(val, datetime.datetime):
+                return val.isoformat(' ')
+            if isinstance(val, datetime.date):
+                return val.isoformat()
+            return val
+
+        df = df.copy()
+        for col in df.columns:
+            first = df[col].dropna().head(1).tolist()
+            if first and isinstance(first[0], datetime.date): # Timestamps are datetime.date subclasses
+                df[col] = df[col].astype(object).map(iso_format, na_action='ignore')
+        df = df.astype(object).where(df.notna(), None)
+        return df.itertuples(index=False, name=None)
+
+
+    def __migrate(self):
+        ''' Applies the missing schema migrations, each in its own transaction
+        '''
+        with _migration_lock:
+            conn = self.__connection()
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for target_version, statements in _MIGRATIONS:
+                if target_version <= version:
+                    continue
+                try:
+                    conn.execute('BEGIN IMMEDIATE')
+                    for statement in statements:
+                        if callable(statement):
+                            statement(conn)
+                        else:
+                            conn.execute(statement)
+                    conn.execute(f'PRAGMA user_version = {target_version}')
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                version = target_version
+            conn.execute('PRAGMA optimize') # Refresh the planner statistics for the new indexes
+            _migrated.add(self.__db_name)
+
+
     def __init_local_db(self):
-        conn = sqlite3.connect(self.__db_name)
+        conn = self.__connection()
 
         conn.execute('''
                      CREATE TABLE f_transactions (
@@ -200,5 +667,4 @@ class GoogleCloudAPI():
                         (25,'transaction','HOUSEHOLD-ITEMS','Furnitures, Maintenence, Ikea, Cleaning stuff'); 
                      ''')
         
-        conn.commit()
-        conn.close()
\ No newline at end of file
+        conn.commit()
\ No newline at end of file
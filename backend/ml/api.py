@@ -4,6 +4,12 @@ import os
 import pickle
 import datetime
 from backend.ml.model import NB
+from backend.ml.model_file import save_model, load_model
+from backend.ml.registry import model_registry
+from backend.ml.training_store import training_store
+from backend.ml.receiver_memo import receiver_memo
+from backend.ml.jobs import training_jobs
+from backend.ml.validation import CrossValidator
 from backend.google_cloud.api import GoogleCloudAPI
 
 
@@ -12,17 +18,20 @@ class MLAPI():
     def __init__(self):
         self.__client = GoogleCloudAPI()
         self.__model = None
-        self.__model_name = 'ai_model.pkl'
+        self.__uses_shared_model = False # The model is the read-only instance of the registry
+        self.__model_name = 'ai_model.bin'
+        self.__legacy_model_name = 'ai_model.pkl' # Pickled models of the previous versions
         self.__nan = 'N/A'
 
 
     def predict(self, data: pd.DataFrame):
         """ Reuturns the predicted target Classes.
         
-        The model returns a dict containing all the classes,
-        in descending order, The first class is selected,
-        and the prortional probability to the total pool 
-        is also returned.
+        The recurring receivers are resolved from the receiver memo first,
+        and their probability is the share of the majority category.
+        Only the unresolved rows are scored by the model, that returns the normalized 
+        propabilities of all classes, the most likely class is selected, and its 
+        prortional probability to the total pool is also returned.
 
         Inputs
         -----
@@ -32,46 +41,47 @@ class MLAPI():
         Returns
         -------
         y_predicted: list
-            Model y ouputs. If model is not loaded, fill all values by <self.__nan>
+            Model y ouputs. If model is not loaded, fill the unresolved values by <self.__nan>
 
         realative_pob: list
             The Prob of returned classe, in relation to the total pool
         """
-        if self.__model is None:
-            return [self.__nan] * len(data), [0] * len(data)
-        
-        preds = self.__model_get_predictions(data)
-
-        def relative_prob(pred_dict):
-            target_prob = next(iter(pred_dict.values()))
-            total_prob = sum(pred_dict.values())
-            return target_prob / total_prob
-
-        probs= [relative_prob(pred_dict) for pred_dict in preds]
-        targets = [next(iter(pred_dict.keys())) for pred_dict in preds]
-
-        return targets, probs
+        self.__sync_shared_model()
+        targets = pd.Series(self.__nan, index=data.index, dtype=object)
+        probs = pd.Series(0.0, index=data.index)
+        resolved = np.zeros(len(data), dtype=bool)
+
+        receiver_col = next((col for col in data.columns if col.lower() == 'receiver'), None)
+        if receiver_col is not None:
+            categories, shares = receiver_memo.lookup(data[receiver_col])
+            resolved = pd.notna(categories)
+            targets[resolved] = categories[resolved]
+            probs[resolved] = shares[resolved]
+
+        if self.__model is not None and not resolved.all():
+            unresolved = data.loc[~resolved] # Only these rows are scored, the memo results are final
+            X_string, X_numeric = self.__prediction_features(unresolved)
+            model_probs = self.__model.predict_proba(X_string, X_numeric) # Softmax of the log posterriors, does not underflow
+            best = model_probs.argmax(axis=1)
+            targets[~resolved] = self.__model.get_classes()[best] # Aligned by the row index of the unresolved rows
+            probs[~resolved] = model_probs[np.arange(best.shape[0]), best]
+        return targets.tolist(), probs.tolist()
+
+
+    def pull_training_data(self, date_from=None, date_to=None):
+        """ Select required columns from the database
 
+        The rows are served from the materialized training set, 
+        that reads only the rows committed since the previous pull.
 
-    def pull_training_data(self):
-        """ Select required columns from the database
+        Inputs
+        ------
+        date_from : date
+            Optional inclusive start date
+        date_to : date
+            Optional inclusive end date
         """
-        sql=f"""
-        SELECT
-            KeyDate as date,
-            Receiver as receiver,
-            Amount as amount,
-            Category as category
-        FROM
-            {self.__client._dataset}.f_transactions
-        WHERE
-            Category != 'N/A'
-        """
-        df = self.__client.sql_to_pandas(sql)
-        df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d').dt.date
-        df.sort_values('date', inplace=True)
-        df = df.dropna().reset_index(drop=True)
-        return df
+        return training_store.get(date_from, date_to)
     
         
     def train_new_model(self, data:pd.DataFrame, target_col:str):
@@ -90,36 +100,133 @@ class MLAPI():
         target_col : str
             The name of the y actuall target classes
         """
-        data = data.loc[(data[target_col].notnull()) & (data[target_col] != 'N/A')] # All rows must have a target
-        data = data.fillna('') 
-        X_numeric = data.select_dtypes(include=['float']).to_numpy()
-        X_string = data.drop(target_col, axis=1).select_dtypes(include=['object']).to_numpy()
-        y = data[target_col].to_numpy()
+        X_string, X_numeric, y = self.__training_features(data, target_col)
 
         nb = NB()
         nb.fit(X_string, X_numeric, y)
         self.__model = nb
+        self.__uses_shared_model = False
+
+
+    def submit_training(self, data: pd.DataFrame, target_col: str, params: tuple = (), retry: bool = False) -> str:
+        """ Trains a new model in the background, and returns the job id immediately.
+
+        The job is keyed by the parameters and a hash of the data, thus, 
+        repeated submits of the same training return the same job,
+        and an already trained model is reused without training it again.
+        The features are built in the background job, only if the key is new.
+
+        Inputs
+        ------
+        data : pd.DataFrame
+            All columns are used to train the model
+
+        target_col : str
+            The name of the y actuall target classes
+
+        params : tuple
+            The parameters that the data was selected with, e.g. (date_from, date_to, split)
+
+        retry : bool
+            Restart the job of the same key, if it failed or was cancelled
+
+        Returns
+        -------
+        job_id : str
+            Use get_training_job() to follow the progress, and activate_trained_model() to use the model
+        """
+        key = (tuple(params), target_col, int(pd.util.hash_pandas_object(data, index=False).sum()))
+
+        def train(progress):
+            X_string, X_numeric, y = self.__training_features(data, target_col)
+            nb = NB()
+            nb.fit(X_string, X_numeric, y, progress=progress)
+            return nb
+
+        return training_jobs.submit(key, train, retry=retry)
+    
+
+    def get_training_job(self, job_id: str) -> dict:
+        """ Returns the id, status (queued, running, done, failed, cancelled), 
+        progress [0, 1] and error message of the job, or None if the job is unknown
+        """
+        job = training_jobs.get(job_id)
+        return job.to_dict() if job is not None else None
+    
+
+    def cancel_training(self, job_id: str) -> bool:
+        return training_jobs.cancel(job_id)
+    
+
+    def activate_trained_model(self, job_id: str) -> bool:
+        """ Activates the model of a finished job, but does not save it automatically
+        """
+        job = training_jobs.get(job_id)
+        if job is None or job.status != 'done':
+            return False
+        self.__model = job.model # Treated as read-only, the updates make a copy
+        self.__uses_shared_model = False
+        return True
+
+
+    def update_model(self, data: pd.DataFrame, target_col: str) -> bool:
+        """ Folds newly labelled rows into the active model, without retraining it.
+
+        Only the stored token and target counts are updated, thus, 
+        the data must have the same feature columns as the original training data.
+        The model is not saved automatically.
+
+        Inputs
+        ------
+        data : pd.DataFrame
+            New rows, all columns are used as features
+
+        target_col : str
+            The name of the y actuall target classes
+
+        Returns
+        -------
+        updated : bool
+            False, if there is no model, or it has to be trained from scratch
+        """
+        if self.__model is None or not self.__model.supports_partial_fit():
+            return False
+        
+        X_string, X_numeric, y = self.__training_features(data, target_col)
+        if y.shape[0] == 0:
+            return False
+        
+        model = self.__model.copy() # The active model may be shared with other sessions
+        model.partial_fit(X_string, X_numeric, y)
+        self.__model = model
+        self.__uses_shared_model = False
+        receiver_memo.invalidate() # The new labels are in the training set
+        return True
 
 
     def save_model_to_gcs(self):
-        """ Save a model to a file locally using pickle 
+        """ Save a model to a file locally using the array-based model file format
         and upload it to Google Cloud Storage with corresponding ENV prefix
         """
-        with open(self.__model_name, 'wb') as f: # Save the model locally
-            pickle.dump(self.__model, f)
+        save_model(self.__model, self.__model_name) # Save the model locally
+        model_registry.publish(self.__model_name, self.__model) # Other sessions swap to this version on their next access
+        self.__uses_shared_model = True
 
         self.__client.upload_file_to_gcs(self.__model_name) # Initialize a GCS client and upload the file
 
 
     def load_model_from_gcs(self):
         """ Download a model from GCS to the local filesystem,
-        and pickle load it.
+        and memory map it.
+
+        The model is loaded only once per process, and the read-only 
+        instance is shared by all sessions through the model registry.
+        If there is no model file, an old pickled model is loaded instead.
         """
         self.__client.download_file_from_gcs(self.__model_name) # Pull the file from GCS to Local system
-        
-        if os.path.isfile(self.__model_name):
-            with open(self.__model_name,'rb') as f: # Open the local File
-                self.__model = pickle.load(f)
+        if not os.path.isfile(self.__model_name):
+            self.__client.download_file_from_gcs(self.__legacy_model_name)
+        self.__load_shared_model()
 
 
     def get_priors(self) -> dict:
@@ -168,43 +275,199 @@ class MLAPI():
             the propability, and some deviation is allowed when computing the 
             overall accuracy (usefulnes) of the model
         """
-        y_predicted = self.__model_get_predictions(data.drop(target_col, axis=1))
-        wa, stats = self.__get_statistics(y_predicted, y_valid=data[target_col].to_numpy(), accepted_error=accepted_error)
+        ranks, y_valid, _ = self.__get_ranks(data, target_col)
+        wa, stats = self.__get_statistics(ranks, y_valid, accepted_error=accepted_error)
         return wa, stats
+
+
+    def get_validation_report(self, data: pd.DataFrame, target_col: str, max_k: int = 5):
+        """ Returns the top-k accuracy curve and the confusion matrix of the validation data.
+
+        Inputs
+        ------
+        data : pd.DataFram
+            Validation dataframe
+        
+        target_col : str
+            Name of the target column
+
+        max_k : int
+            The curve is computed for k = 1...max_k
+
+        Returns
+        -------
+        top_k : pd.DataFrame
+            Share of the rows, where the target is in the first k places
+        
+        confusion : pd.DataFrame
+            Number of rows of the actual (index) target class, predicted as the (column) class
+        """
+        ranks, y_valid, y_predicted = self.__get_ranks(data, target_col)
+        classes = self.__model.get_classes()
+
+        hits = np.cumsum(np.bincount(ranks, minlength=max_k)[:max_k]) # Rows with the target in the first k places
+        top_k = pd.DataFrame({'k': np.arange(1, max_k + 1), 'accuracy': hits / max(ranks.shape[0], 1)})
+
+        n_classes = classes.shape[0]
+        matrix = np.bincount(y_valid * n_classes + y_predicted, minlength=n_classes * n_classes).reshape(n_classes, n_classes)
+        used = (matrix.sum(axis=0) > 0) | (matrix.sum(axis=1) > 0) # Only the actual and predicted classes
+        confusion = pd.DataFrame(matrix[used][:, used], index=classes[used], columns=classes[used])
+        return top_k, confusion
     
 
+    def cross_validate(self, data: pd.DataFrame, target_col: str, date_col: str = 'date', n_folds: int = 5, scheme: str = 'rolling',
+                       alphas: tuple = (1.0,), amount_bins: tuple = ((20, 100),), tokenizers: tuple = ({},), accepted_error: int = 1):
+        """ Cross-validates all combinations of the model parameters in chronological folds.
+
+        Inputs
+        ------
+        data : pd.DataFrame
+            Training data, all columns except the date are used as features
+
+        target_col : str
+            The name of the y actuall target classes
+
+        date_col : str
+            The rows are ordered by this column, and it is not used as a feature
+
+        n_folds : int
+            Number of validated blocks
+
+        scheme : str
+            rolling: train with the past blocks only, kfold: train with all the other blocks
+
+        alphas, amount_bins, tokenizers : tuple
+            The smoothing strengths, (small, large) amount boundaries and Tokenizer arguments to evaluate
+
+        accepted_error : int
+            The maximum allowed deviation from the first place, as in validate_model()
+
+        Returns
+        -------
+        results : pd.DataFrame
+            Accuracy and wall-clock seconds of each fold and parameter combination
+
+        summary : pd.DataFrame
+            Mean accuracy of each parameter combination, the best first
+        """
+        data = data.sort_values(by=date_col, kind='stable').drop(date_col, axis=1)
+        X_string, X_numeric, y = self.__training_features(data, target_col)
+
+        validator = CrossValidator(n_folds=n_folds, scheme=scheme, accepted_error=accepted_error)
+        return validator.run(X_string, X_numeric, y, alphas=alphas, amount_bins=amount_bins, tokenizers=tokenizers)
+
+
+    def get_tokenizer_stats(self) -> dict:
+        """ Returns the token cache hit-rate statistics of the active model
+        """
+        if self.__model is not None:
+            return self.__model.get_tokenizer_stats()
+        else:
+            return {}
+
+
     def has_model(self):
         """ Used to check if the model has been initialized
         """
+        self.__sync_shared_model()
         return self.__model is not None
     
 
-    def __model_get_predictions(self, data: pd.DataFrame)->dict:
-        """ Run model prediction
-        
+    @staticmethod
+    def get_receiver_memo_stats() -> dict:
+        """ Returns the share of the predicted rows, that were resolved without the model scoring
+        """
+        return receiver_memo.stats()
+    
+
+    @staticmethod
+    def get_registry_stats() -> dict:
+        """ Returns the load count and memory metrics of the process-wide model registry
+        """
+        return model_registry.stats()
+    
+
+    def __sync_shared_model(self):
+        """ Swaps to the latest version of the shared model, if a new one has been saved
+        """
+        if self.__uses_shared_model:
+            self.__load_shared_model()
+
+
+    def __load_shared_model(self):
+        for path, loader in [(self.__model_name, load_model), (self.__legacy_model_name, self.__load_pickled_model)]:
+            model = model_registry.get(path, loader)
+            if model is not None:
+                self.__model = model
+                self.__uses_shared_model = True
+                return
+    
+
+    @staticmethod
+    def __load_pickled_model(path: str) -> NB:
+        with open(path,'rb') as f: # Open the local File
+            return pickle.load(f)
+    
+
+    def __training_features(self, data: pd.DataFrame, target_col: str):
+        """ Splits the training data into the string, numeric and target arrays
+        """
+        data = data.loc[(data[target_col].notnull()) & (data[target_col] != self.__nan)] # All rows must have a target
+        data = data.fillna('') 
+        X_numeric = data.select_dtypes(include=['float']).to_numpy()
+        X_string = data.drop(target_col, axis=1).select_dtypes(include=['object']).to_numpy()
+        y = data[target_col].to_numpy()
+        return X_string, X_numeric, y
+    
+
+    def __get_ranks(self, data: pd.DataFrame, target_col: str):
+        """ Scores the validation data, and finds the place of the actual target of each row.
+
+        Rows of the targets that are not known by the model are skipped.
+
         Returns
         -------
-        predictions : dict
-            A dictionary containing all target classe in descending order of the propability
+        ranks : np.array
+            Place of the actual target in the descending order of the propabilities, 0 is the first
+        y_valid : np.array
+            Class index of the actual target
+        y_predicted : np.array
+            Class index of the most likely target
+        """
+        X_string, X_numeric = self.__prediction_features(data.drop(target_col, axis=1))
+        classes = self.__model.get_classes()
+        order, _ = self.__model.predict_top_k(X_string, X_numeric, k=classes.shape[0]) # [row, place] class index
+
+        codes = pd.Series(np.arange(classes.shape[0]), index=classes)
+        y_valid = codes.reindex(data[target_col].to_numpy()).to_numpy()
+        known = ~np.isnan(y_valid)
+        y_valid = y_valid[known].astype(int)
+        order = order[known]
+
+        ranks = np.argmax(order == y_valid[:, np.newaxis], axis=1)
+        return ranks, y_valid, order[:, 0]
+    
+
+    def __prediction_features(self, data: pd.DataFrame):
+        """ Splits the input data into the string and numeric arrays
         """
         data = data.fillna('') 
         data = data.drop(columns=[col for col in data.columns if any(isinstance(val, (datetime.date, datetime.datetime)) for val in data[col])]) # Remove the Date-type column
         X_numeric = data.select_dtypes(include=['float']).to_numpy()
         X_string = data.select_dtypes(include=['object']).to_numpy()
-        preds = self.__model.predict(X_string, X_numeric)
-        return preds
+        return X_string, X_numeric
 
 
-    def __get_statistics(self, y_predicted: list, y_valid: list, accepted_error: int):
+    def __get_statistics(self, ranks: np.array, y_valid: np.array, accepted_error: int):
         """ A helper function to compute accuracy statistics for the trained model.
 
         Inputs
         ------
-        y_predicted : list
-            Model ouputs for the predicted target classes
+        ranks : np.array
+            Place of the actual target in the model outputs, 0 is the first
 
-        y_valid: list
-            Actual target classes
+        y_valid: np.array
+            Class index of the actual target
 
         accepted_error : int
             The maximum allowed deviation from the first place of the target list.
@@ -212,31 +475,26 @@ class MLAPI():
             the propability, and some deviation is allowed when computing the 
             overall accuracy (usefulnes) of the model
         """
-        def get_accuracy(df_group):
-            count = df_group.shape[0]
-            trues = df_group.loc[df_group['acceptable'] == True].shape[0]
-            return trues / count
-
-        errors = []
-        labels = []
-        for i, row in enumerate(y_predicted):
-            try:
-                errors.append(int(list(row.keys()).index(y_valid[i])))
-                labels.append(y_valid[i])
-            except ValueError:
-                pass
-        df_errors = pd.DataFrame(zip(labels, errors), columns=['y_valid', 'order'])
-
-        df_accuracy = df_errors.copy()
-        df_accuracy['acceptable'] = df_accuracy['order'] <= accepted_error
-        df_accuracy = df_accuracy.groupby(['y_valid']).apply(lambda x: get_accuracy(x)).rename('accuracy').reset_index()
-        
-        df_stats = df_errors.groupby('y_valid').agg(count=('order', 'count'),
-                                                    place_q50=('order', lambda x: np.percentile(x, 50)),
-                                                    ).reset_index()
-        
-        df_stats = pd.merge(df_stats, df_accuracy, left_on='y_valid', right_on='y_valid')
+        classes = self.__model.get_classes()
+        n_classes = classes.shape[0]
+        counts = np.bincount(y_valid, minlength=n_classes)
+        acceptable = np.bincount(y_valid, weights=ranks <= accepted_error, minlength=n_classes)
+
+        # Medians from the ranks sorted within each class, the mean of the two middle values on even counts
+        sorted_ranks = ranks[np.lexsort((ranks, y_valid))]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        present = counts > 0
+        lower = sorted_ranks[(starts + (counts - 1) // 2)[present]]
+        upper = sorted_ranks[(starts + counts // 2)[present]]
+
+        df_stats = pd.DataFrame({
+            'y_valid': classes[present],
+            'count': counts[present],
+            'place_q50': (lower + upper) / 2,
+            'accuracy': acceptable[present] / counts[present],
+        })
+        df_stats = df_stats.sort_values(by='y_valid').reset_index(drop=True) # Same tie order as a groupby by the class
         df_stats = df_stats.sort_values(by='count', ascending=False).reset_index(drop=True)
 
         w_accuracy = np.average(df_stats['accuracy'].values, weights=df_stats['count'].values) # Weighted accuracy
-        return w_accuracy, df_stats
\ No newline at end of file
+        return w_accuracy, df_stats
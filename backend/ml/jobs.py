@@ -0,0 +1,135 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TrainingCancelled(Exception):
+    pass
+
+
+class TrainingJob():
+    ''' State of one background training job
+    '''
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'queued' # queued, running, done, failed, cancelled
+        self.progress = 0.0
+        self.model = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def is_active(self) -> bool:
+        return self.status in ('queued', 'running')
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+        }
+
+
+class TrainingJobManager():
+    ''' Runs model trainings in a background thread pool.
+
+    The jobs are identified by a key of the training parameters.
+    A submit with the key of an existing job returns that job,
+    thus, repeated Streamlit reruns with the same parameters do not retrain,
+    and the models of the recently seen parameter sets are served from memory.
+    A failed or cancelled job is kept, until it is explicitly retried.
+    '''
+
+    def __init__(self, max_workers: int = 2, max_finished: int = 16):
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='training')
+        self.__max_finished = max_finished
+        self.__lock = threading.Lock()
+        self.__jobs = {} # {job_id: TrainingJob}
+        self.__by_key = OrderedDict() # {key: job_id} in the least recently used order
+
+
+    def submit(self, key, train, retry: bool = False) -> str:
+        ''' Start a new training, unless the key already has a job.
+
+        Inputs
+        ------
+        key : hashable
+            Identifies the training parameters and data
+        train : callable
+            train(progress) returns the trained model, where progress(fraction)
+            must be called during the training, and it raises TrainingCancelled on cancellation
+        retry : bool
+            Restart a failed or cancelled job of the key, otherwise that job is returned
+
+        Returns
+        -------
+        job_id : str
+        '''
+        with self.__lock:
+            job_id = self.__by_key.get(key)
+            if job_id is not None:
+                if not retry or self.__jobs[job_id].status in ('queued', 'running', 'done'):
+                    self.__by_key.move_to_end(key)
+                    return job_id
+                del self.__jobs[job_id] # Failed or cancelled, explicitly retried
+            
+            job = TrainingJob(key)
+            self.__jobs[job.id] = job
+            self.__by_key[key] = job.id
+            self.__evict()
+            job.future = self.__executor.submit(self.__run, job, train)
+            return job.id
+
+
+    def get(self, job_id: str) -> TrainingJob:
+        with self.__lock:
+            return self.__jobs.get(job_id)
+
+
+    def cancel(self, job_id: str) -> bool:
+        ''' Cancel a queued or running job, returns False if it already finished
+        '''
+        with self.__lock:
+            job = self.__jobs.get(job_id)
+            if job is None or not job.is_active():
+                return False
+            job.cancel_event.set()
+            if job.future.cancel(): # Was still in the queue
+                job.status = 'cancelled'
+            return True
+
+
+    def __run(self, job: TrainingJob, train):
+        def progress(fraction: float):
+            if job.cancel_event.is_set():
+                raise TrainingCancelled()
+            job.progress = fraction
+
+        job.status = 'running'
+        try:
+            job.model = train(progress)
+            job.progress = 1.0
+            job.status = 'done'
+        except TrainingCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+
+
+    def __evict(self):
+        # Must be called with the lock held, the active jobs are never evicted
+        while len(self.__by_key) > self.__max_finished:
+            for key, job_id in self.__by_key.items():
+                if not self.__jobs[job_id].is_active():
+                    del self.__by_key[key]
+                    del self.__jobs[job_id]
+                    break
+            else:
+                return
+
+
+training_jobs = TrainingJobManager()
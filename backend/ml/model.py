@@ -1,84 +1,425 @@
 import numpy as np
 import re
+import zlib
+import threading
+from collections import OrderedDict
+from itertools import chain
+
+
+class Tokenizer():
+    ''' Splits a merged row string into lower case word tokens.
+
+    The same receivers (grocery chains, salary payers, etc.) recur thousands of times, 
+    thus the tokens of each raw string are memoized in a bounded LRU cache.
+    Optionally, the tokens can be hashed into a fixed number of buckets (the hashing trick),
+    so that unseen tokens do not grow the vocabulary.
+    '''
+    _pattern = re.compile(r'[.;,_*\s-]+')
+
+    def __init__(self, cache_size: int = 50000, n_buckets: int = None):
+        self.cache_size = cache_size
+        self.n_buckets = n_buckets
+        self._init_cache()
+
+    def __getstate__(self):
+        return {'cache_size': self.cache_size, 'n_buckets': self.n_buckets} # The cache is not persisted
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_cache()
+
+    def tokenize(self, text: str) -> tuple:
+        ''' Returns the tokens of the string, digits only tokens are dropped
+        '''
+        with self._lock:
+            tokens = self._cache.get(text)
+            if tokens is not None:
+                self._cache.move_to_end(text)
+                self._hits += 1
+                return tokens
+            self._misses += 1
+
+        tokens = tuple(word for word in self._pattern.split(text.lower()) if not word.isdigit())
+        with self._lock:
+            self._cache[text] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False) # Least recently used
+        return tokens
+
+    def hash(self, token: str) -> int:
+        ''' Stable bucket id of a token, when the hashing trick is used
+        '''
+        return zlib.crc32(token.encode('utf-8')) % self.n_buckets
+
+    def is_hashing(self) -> bool:
+        return self.n_buckets is not None
+
+    def stats(self) -> dict:
+        ''' Returns the cache hit and miss counters
+        '''
+        with self._lock:
+            calls = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / calls if calls > 0 else 0.0,
+                'size': len(self._cache)
+            }
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _init_cache(self):
+        self._cache = OrderedDict() # {raw string: tokens}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
 
 
 class NB():
-    def __init__(self):
+    _amount_labels = np.array(['smallAmount', 'mediumAmount', 'largeAmount'], dtype=object)
+
+    def __init__(self, tokenizer: Tokenizer = None, alpha: float = 1.0, amount_bins: tuple = (20, 100)):
+        assert alpha > 0, 'The smoothing alpha must be positive'
+        assert len(amount_bins) == 2 and amount_bins[0] <= amount_bins[1], 'The amount bins must be the (small, large) boundaries'
+        self._tokenizer = tokenizer if tokenizer is not None else Tokenizer()
+        self._alpha = float(alpha)
+        self._amount_bins = tuple(amount_bins)
         self._y_encode = {}
         self._y_decode = {}
         self._X_encode = {}
         self._X_decode = {}
         self._priors = {}
-        self._likelihoods = {}
+        self._likelihoods = np.empty((0, 0)) # [target, token] smoothed likelihood matrix
         self._propabilities = {}
+        self._class_counts = np.empty(0, dtype=int) # Training rows per target
+        self._doc_counts = np.empty((0, 0), dtype=int) # [target, token] rows that contain the token
+        self._log_priors = np.empty(0)
+        self._log_likelihoods = np.empty((0, 0)) # [target, token] matrix used for the batch scoring
 
-    def fit(self, str_features: np.array, float_features: np.array, y: np.array):
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if '_tokenizer' not in state: # Models pickled before the cached tokenizer
+            self._tokenizer = Tokenizer()
+        if '_alpha' not in state: # Models pickled before the configurable smoothing
+            self._alpha = 1.0
+            self._amount_bins = (20, 100)
+        if isinstance(self._likelihoods, dict): # Models pickled before the matrix training
+            self._likelihoods = self._likelihood_dicts_to_matrix(self._likelihoods)
+        if '_log_likelihoods' not in state: # Models pickled before the matrix scoring
+            self._compute_log_matrices()
+        if '_doc_counts' not in state: # Models pickled before the count statistics, can not be updated
+            self._class_counts = None
+            self._doc_counts = None
+
+    def fit(self, str_features: np.array, float_features: np.array, y: np.array, progress=None):
+        ''' Fits the model from scratch.
+
+        The optional progress callable is called with the completed fraction [0, 1]
+        between the training stages. It may raise an exception to abort the training.
+        '''
         def word_coder(values: list) -> dict:
             decode = {i: label for i, label in enumerate(set(values))}
             encode = {label: i for i, label in enumerate(set(values))}
             return encode, decode
         
+        report = progress if progress is not None else (lambda fraction: None)
         self._validate_data(str_features, float_features, y)
+        report(0.1)
 
         X_float = self._transform_X_float(float_features)
         str_features = np.concatenate((str_features, X_float), axis=1)
 
         nested_word_list = self._process_str_features(str_features)
+        report(0.5)
         word_list = set(value for nested in nested_word_list for value in nested) # Unnest unique words
 
-        self._X_encode, self._X_decode = word_coder(word_list)
+        if self._tokenizer.is_hashing(): # The vocabulary is the fixed bucket space, only the decode is for displaying
+            self._X_encode = {word: self._tokenizer.hash(word) for word in word_list}
+            self._X_decode = {i: word for word, i in self._X_encode.items()}
+        else:
+            self._X_encode, self._X_decode = word_coder(word_list)
         self._y_encode, self._y_decode = word_coder(y)
 
-        X_str = self._transform_X(str_features)
+        indices, offsets = self._encode_tokens(nested_word_list)
         y = self._transform_y(y)
+        report(0.7)
 
-        self._compute_priors(y)
-        self._compute_likelihoods(X_str, y)
+        self._doc_counts, self._class_counts = self._count_documents(indices, offsets, y)
+        report(0.9)
+        self._compute_priors()
+        self._compute_likelihoods()
+        self._compute_log_matrices()
+        report(1.0)
 
 
-    def predict(self, str_features: np.array, float_features: np.array):
+    def partial_fit(self, str_features: np.array, float_features: np.array, y: np.array):
+        ''' Folds new rows into the stored token and target counts.
+
+        The counts are the sufficient statistics of the model, 
+        thus the result is the same as fitting from scratch with all rows.
+        Unseen tokens and targets are added to the vocabulary on the fly.
+        A model that has not been fitted yet is simply fitted.
+        '''
+        if len(self._y_decode) == 0:
+            return self.fit(str_features, float_features, y)
+        assert self.supports_partial_fit(), 'The model does not have the training counts, and must be fitted from scratch'
+        
+        self._validate_data(str_features, float_features, y)
+
         X_float = self._transform_X_float(float_features)
         str_features = np.concatenate((str_features, X_float), axis=1)
-        X_str = self._transform_X(str_features)
-        X_float =float_features
+
+        nested_word_list = self._process_str_features(str_features)
+        for word in dict.fromkeys(value for nested in nested_word_list for value in nested): # Unique words in the order of appearance
+            if word not in self._X_encode:
+                self._X_encode[word] = self._tokenizer.hash(word) if self._tokenizer.is_hashing() else len(self._X_decode)
+                self._X_decode.setdefault(self._X_encode[word], word)
+        for label in dict.fromkeys(y):
+            if label not in self._y_encode:
+                self._y_encode[label] = len(self._y_decode)
+                self._y_decode[len(self._y_decode)] = label
+
+        indices, offsets = self._encode_tokens(nested_word_list)
+        y = self._transform_y(y)
+
+        doc_counts, class_counts = self._count_documents(indices, offsets, y)
+        n_targets, n_tokens = doc_counts.shape
+        old_targets, old_tokens = self._doc_counts.shape
+        self._doc_counts = np.pad(self._doc_counts, ((0, n_targets - old_targets), (0, n_tokens - old_tokens))) + doc_counts # New arrays, the old ones may be shared
+        self._class_counts = np.pad(self._class_counts, (0, n_targets - old_targets)) + class_counts
+        self._compute_priors()
+        self._compute_likelihoods()
+        self._compute_log_matrices()
+
+
+    def supports_partial_fit(self) -> bool:
+        ''' Models pickled before the count statistics can not be updated
+        '''
+        counts = getattr(self, '_doc_counts', None)
+        return counts is not None and counts.shape == self._likelihoods.shape
+
+
+    def predict(self, str_features: np.array, float_features: np.array):
+        posterriors = self._log_posterriors(str_features, float_features)
+        order = np.argsort(-posterriors, axis=1, kind='stable') # Descending, ties keep the target order
         predictions = []
-        for str_row in X_str:
-            target_values = {}
-            for target in self._y_decode:
-                likes = [self._likelihoods[target][feature] for feature in str_row if feature in self._likelihoods[target]]
-                posterrior = np.log(likes).sum() + np.log(self._priors[target])
-                #print(f'Post {posterrior:.1f}, Prior {np.log(self._priors[target]):.1f}, Likely {np.log(likes).sum():.1f}, Probs {np.log(probs).sum():.1f}')
-                target_values.update({target: np.exp(posterrior)})   
-            labels = {self._y_decode[k]: v for k, v in sorted(target_values.items(), key=lambda item: item[1], reverse=True)}
+        for row, row_order in zip(posterriors, order):
+            labels = {self._y_decode[k]: np.exp(row[k]) for k in row_order}
             predictions.append(labels)
         return predictions
 
 
+    def predict_proba(self, str_features: np.array, float_features: np.array) -> np.array:
+        ''' Posterrior propabilities of all targets, normalized in the log-space.
+
+        Returns
+        -------
+        probs : np.array
+            [rows, targets] in the index order of get_classes(), each row sums to one
+        '''
+        return np.exp(self.predict_log_proba(str_features, float_features))
+
+
+    def predict_log_proba(self, str_features: np.array, float_features: np.array) -> np.array:
+        ''' Normalized log posterriors using the log-sum-exp trick.
+
+        The raw posterriors of long strings underflow to zero, if exponentiated directly,
+        thus the row maximum is subtracted before the exponentiation.
+        '''
+        posterriors = self._log_posterriors(str_features, float_features)
+        row_max = posterriors.max(axis=1, keepdims=True)
+        log_norm = row_max + np.log(np.exp(posterriors - row_max).sum(axis=1, keepdims=True))
+        return posterriors - log_norm
+
+
+    def predict_top_k(self, str_features: np.array, float_features: np.array, k: int = 3):
+        ''' Compact batch prediction without the per-row dicts.
+
+        Returns
+        -------
+        indices : np.array
+            [rows, k] target indices in descending order, decode with get_classes()
+        scores : np.array
+            [rows, k] matching log posterriors
+        '''
+        posterriors = self._log_posterriors(str_features, float_features)
+        k = min(k, posterriors.shape[1])
+        indices = np.argsort(-posterriors, axis=1, kind='stable')[:, :k]
+        scores = np.take_along_axis(posterriors, indices, axis=1)
+        return indices, scores
+
+
+    def encode(self, str_features: np.array, float_features: np.array):
+        ''' Encodes the rows with the fitted vocabulary, unknown tokens are dropped.
+
+        Returns
+        -------
+        indices : np.array
+            Token ids of all rows concatenated
+        offsets : np.array
+            Start position of each row in the indices, and the total length as the last value
+        '''
+        X_float = self._transform_X_float(float_features)
+        str_features = np.concatenate((str_features, X_float), axis=1)
+        return self._transform_X(str_features)
+
+
+    def get_params(self) -> dict:
+        return {'tokenizer': self._tokenizer.__getstate__(), 'alpha': self._alpha, 'amount_bins': self._amount_bins}
+
+
+    def get_tokenizer_stats(self) -> dict:
+        return self._tokenizer.stats()
+
+
+    def get_classes(self) -> np.array:
+        ''' Target labels in the index order of the score matrices
+        '''
+        return np.array([self._y_decode[i] for i in range(len(self._y_decode))], dtype=object)
+
+
+    def to_arrays(self):
+        ''' Exports the fitted state for the array-based model file.
+
+        Returns
+        -------
+        meta : dict
+            JSON serializable tokenizer settings, target labels and the vocabulary string table
+        arrays : dict
+            Named numpy arrays
+        '''
+        meta = {
+            'tokenizer': self._tokenizer.__getstate__(),
+            'alpha': self._alpha,
+            'amount_bins': list(self._amount_bins),
+            'classes': self.get_classes().tolist(),
+            'vocabulary': list(self._X_encode.keys()),
+        }
+        arrays = {
+            'vocabulary_ids': np.fromiter(self._X_encode.values(), dtype=np.int64, count=len(self._X_encode)),
+            'priors': np.array([self._priors[target] for target in range(len(self._y_decode))]),
+            'log_priors': np.asarray(self._log_priors),
+            'likelihoods': np.asarray(self._likelihoods),
+            'log_likelihoods': np.asarray(self._log_likelihoods),
+        }
+        if self.supports_partial_fit():
+            arrays['class_counts'] = np.asarray(self._class_counts)
+            arrays['doc_counts'] = np.asarray(self._doc_counts)
+        return meta, arrays
+
+
+    @classmethod
+    def from_arrays(cls, meta: dict, arrays: dict):
+        ''' Restores a fitted model from the output of to_arrays().
+        
+        The arrays are used as is, thus, those can be read-only memory maps.
+        '''
+        tokenizer = Tokenizer()
+        tokenizer.__setstate__(meta['tokenizer'])
+        nb = cls(tokenizer, meta.get('alpha', 1.0), meta.get('amount_bins', (20, 100)))
+        nb._y_decode = dict(enumerate(meta['classes']))
+        nb._y_encode = {label: i for i, label in nb._y_decode.items()}
+        nb._X_encode = dict(zip(meta['vocabulary'], arrays['vocabulary_ids'].tolist()))
+        for word, i in nb._X_encode.items():
+            nb._X_decode.setdefault(i, word)
+        nb._priors = dict(enumerate(arrays['priors'].tolist()))
+        nb._log_priors = arrays['log_priors']
+        nb._likelihoods = arrays['likelihoods']
+        nb._log_likelihoods = arrays['log_likelihoods']
+        if 'doc_counts' in arrays:
+            nb._class_counts = arrays['class_counts']
+            nb._doc_counts = arrays['doc_counts']
+        return nb
+
+
+    def copy(self):
+        ''' A copy that can be modified without affecting this model.
+
+        The arrays are shared, since those are always replaced, not modified in place.
+        '''
+        return NB.from_arrays(*self.to_arrays())
+
+
+    def get_memory_usage(self) -> int:
+        ''' Bytes used by the model arrays (memory mapped arrays included)
+        '''
+        names = ['_likelihoods', '_log_likelihoods', '_log_priors', '_class_counts', '_doc_counts']
+        arrays = [getattr(self, name, None) for name in names] # Legacy models lack some of the arrays
+        return sum(np.asarray(array).nbytes for array in arrays if array is not None)
+
+
     def get_priors(self):
         return {self._y_decode[k]: v for k, v in sorted(self._priors.items(), key=lambda item: item[1], reverse=True)}
     
     def get_likelihoods(self):
         likes = {}
         for target in self.get_priors():
-            values = {self._X_decode[k]: v for k, v in sorted(self._likelihoods[self._y_encode[target]].items(), key=lambda item: item[1], reverse=True)}
+            row = self._likelihoods[self._y_encode[target]]
+            values = {self._X_decode[k]: row[k] for k in np.argsort(-row, kind='stable') if k in self._X_decode} # Unused hash buckets are skipped
             likes[target] = values  
         return likes
     
 
-    def _transform_X(self, str_features: np.array) -> np.array:
-        X_str = self._process_str_features(str_features)
-        n_cols = len(max(X_str, key=len))
-        for i, row in enumerate(X_str):
-            coded = [self._X_encode[word] if word in self._X_encode else -1 for word in row]
-            X_str[i] = np.pad(coded, (0, n_cols - len(coded)), 'constant', constant_values=(-1))
-        return np.array(X_str)
+    def _log_posterriors(self, str_features: np.array, float_features: np.array) -> np.array:
+        ''' Scores the whole batch at once.
+
+        The summed token log-likelihoods of a row are a product of the
+        sparse [row, token] count matrix and the dense [token, target] matrix,
+        which is computed by gathering the columns of the known tokens.
+        Unknown tokens are not encoded, and do not contribute to the score.
+        '''
+        indices, offsets = self.encode(str_features, float_features)
+        rows = self._token_rows(offsets)
+
+        posterriors = np.tile(self._log_priors, (offsets.shape[0] - 1, 1))
+        np.add.at(posterriors, rows, self._log_likelihoods.T[indices])
+        return posterriors
+
+
+    def _transform_X(self, str_features: np.array):
+        return self._encode_tokens(self._process_str_features(str_features))
     
-    def _transform_X_float(self, float_features: np.array) -> np.array:
-        X_float = np.empty((float_features.shape), dtype=object)
 
-        X_float[np.abs(float_features) >= 100] = 'largeAmount'
-        X_float[np.abs(float_features) < 100] = 'mediumAmount'
-        X_float[np.abs(float_features) < 20] = 'smallAmount'
+    def _encode_tokens(self, nested_word_list: list):
+        ''' Encodes the tokens of all rows into a compact CSR-style representation.
+
+        The tokens of row i are indices[offsets[i]:offsets[i + 1]], 
+        and the rows are not padded. The vocabulary lookup is done only once
+        per unique word, and unknown words are dropped.
+
+        Returns
+        -------
+        indices : np.array
+            Token ids of all rows concatenated
+        offsets : np.array
+            Start position of each row in the indices, and the total length as the last value
+        '''
+        n_rows = len(nested_word_list)
+        lengths = np.fromiter((len(row) for row in nested_word_list), dtype=int, count=n_rows)
+        words = np.fromiter(chain.from_iterable(nested_word_list), dtype=object, count=lengths.sum())
+
+        uniques, inverse = np.unique(words, return_inverse=True)
+        if self._tokenizer.is_hashing():
+            coded = np.array([self._tokenizer.hash(word) for word in uniques], dtype=int)[inverse]
+        else:
+            coded = np.array([self._X_encode.get(word, -1) for word in uniques], dtype=int)[inverse]
+
+        known = coded != -1
+        rows = np.repeat(np.arange(n_rows), lengths)
+        offsets = np.zeros(n_rows + 1, dtype=int)
+        np.cumsum(np.bincount(rows[known], minlength=n_rows), out=offsets[1:])
+        return coded[known], offsets
+    
+
+    def _token_rows(self, offsets: np.array) -> np.array:
+        ''' The row number of each encoded token
+        '''
+        return np.repeat(np.arange(offsets.shape[0] - 1), np.diff(offsets))
+    
+    def _transform_X_float(self, float_features: np.array) -> np.array:
+        X_float = self._amount_labels[np.digitize(np.abs(float_features), self._amount_bins)] # small < bins[0] <= medium < bins[1] <= large
 
         X_float_sign = np.empty((float_features.shape), dtype=object)
         X_float_sign[float_features >= 0] = 'positiveCashflow'
@@ -93,33 +434,62 @@ class NB():
 
 
     def _process_str_features(self, str_features: np.array):
-        merged = np.array([' '.join(row) for row in str_features]) # Merges all string columns on the same row
-        nested_word_list = [
-            [word for word in re.split(r'[.;,_*\s-]+', str(row).lower()) if not word.isdigit()]
-            for row in merged
-        ]
+        nested_word_list = [self._tokenizer.tokenize(' '.join(row)) for row in str_features] # Merges all string columns on the same row
         return nested_word_list
     
 
-    def _compute_priors(self, y: np.array):
-        labels, counts = np.unique(y, return_counts=True)
-        events = y.shape[0]
-        probs = counts / events
-        priors = {target: prior for target, prior in zip(labels, probs)} 
-        self._priors = priors
+    def _count_documents(self, indices: np.array, offsets: np.array, y: np.array):
+        ''' Computes all per-target token document frequencies in one pass.
+
+        The encoded tokens are turned into a binary [row, token] incidence
+        (a token is counted once per row), and the incidences are counted per target 
+        with a single bincount over the flattened [target, token] index.
+
+        Returns
+        -------
+        doc_counts : np.array
+            [target, token] number of rows that contain the token
+        class_counts : np.array
+            Number of rows per target
+        '''
+        n_targets = len(self._y_decode)
+        n_tokens = self._n_tokens()
+
+        rows = self._token_rows(offsets)
+        incidence = np.unique(rows * n_tokens + indices) # Unique (row, token) pairs
+        doc_rows, doc_tokens = np.divmod(incidence, n_tokens)
+
+        doc_counts = np.bincount(y[doc_rows] * n_tokens + doc_tokens, minlength=n_targets * n_tokens).reshape(n_targets, n_tokens)
+        class_counts = np.bincount(y, minlength=n_targets)
+        return doc_counts, class_counts
+
+
+    def _compute_priors(self):
+        probs = self._class_counts / self._class_counts.sum()
+        self._priors = {target: prior for target, prior in enumerate(probs)}
     
 
-    def _compute_likelihoods(self, X_str: np.array, y: np.array):
-        targets = np.unique(y)
-        for target in targets:
-            sub_set = X_str[y[:] == target] # All rows for one target
-            features = np.unique(sub_set[(sub_set != -1)]) # Do not include paddings
-            known_unkowns = [k for k in self._X_decode if k not in features] # Add missing tokens for current target
-            features = np.concatenate((features, known_unkowns), axis=0)
-            events = sub_set.shape[0]
-            probs = [(np.sum(np.any(sub_set == token, axis=1)) + 1) / (events + 1) for token in features] # Propability too see token, given the target (rows with specific toke / total rows) (+1 to inlcude also missing values)
-            likelihood = {features: prob for features, prob in zip(features, probs)} 
-            self._likelihoods.update({target: likelihood})
+    def _compute_likelihoods(self):
+        self._likelihoods = (self._doc_counts + self._alpha) / (self._class_counts[:, np.newaxis] + self._alpha) # Propability too see token, given the target (rows with specific toke / total rows) (+alpha to inlcude also missing values)
+
+
+    def _compute_log_matrices(self):
+        n_targets = len(self._y_decode)
+        self._log_priors = np.array([np.log(self._priors[target]) for target in range(n_targets)])
+        self._log_likelihoods = np.log(self._likelihoods)
+
+
+    def _likelihood_dicts_to_matrix(self, likelihoods: dict) -> np.array:
+        matrix = np.ones((len(self._y_decode), self._n_tokens()))
+        for target, likelihood in likelihoods.items():
+            tokens = np.fromiter(likelihood.keys(), dtype=int, count=len(likelihood))
+            probs = np.fromiter(likelihood.values(), dtype=float, count=len(likelihood))
+            matrix[target, tokens] = probs
+        return matrix
+
+
+    def _n_tokens(self) -> int:
+        return self._tokenizer.n_buckets if self._tokenizer.is_hashing() else len(self._X_decode)
 
 
     def _validate_data(self, str_features: np.array, float_features: np.array, y: np.array):
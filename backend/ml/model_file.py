@@ -0,0 +1,100 @@
+import numpy as np
+import json
+import os
+import struct
+from backend.ml.model import NB
+
+
+# File layout
+# -----------
+# MAGIC (4 bytes) | format version (uint32) | header length (uint64) | JSON header | arrays
+#
+# The JSON header holds the model metadata (labels, vocabulary string table, etc.) 
+# and the dtype, shape and byte offset of each array. All arrays are stored raw,
+# in C-order and aligned to ALIGNMENT bytes, so those can be memory mapped directly.
+MAGIC = b'NBMF'
+VERSION = 1
+ALIGNMENT = 64
+_PREFIX = struct.Struct('<4sIQ')
+
+
+def save_model(model: NB, path: str):
+    ''' Write the model to the versioned array-based file format.
+
+    The file is written to a temporary file first, and then moved in place,
+    thus, readers never see a partially written model. On POSIX, the existing
+    memory maps of the previous file remain valid. Windows refuses to replace
+    a mapped file, thus, the models are not memory mapped there, see load_model().
+
+    Inputs
+    ------
+    model : NB
+        A fitted model
+    path : str
+        The destination file
+    '''
+    meta, arrays = model.to_arrays()
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    # The header size depends on the offsets, thus, the offsets are relative to the data section
+    layout = {}
+    position = 0
+    for name, array in arrays.items():
+        position = _align(position)
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': position}
+        position += array.nbytes
+
+    header = json.dumps({'meta': meta, 'arrays': layout}).encode('utf-8')
+    data_start = _align(_PREFIX.size + len(header))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREFIX.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.write(b'\0' * (data_start + layout[name]['offset'] - f.tell())) # Padding
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+def load_model(path: str, mmap: bool = None) -> NB:
+    ''' Read a model written by save_model().
+
+    Inputs
+    ------
+    path : str
+        The model file
+    mmap : bool
+        Memory map the arrays read-only, instead of reading those into memory.
+        Defaults to True, except on Windows, where a mapped file can not be replaced or removed
+
+    Returns
+    -------
+    model : NB
+    '''
+    if mmap is None:
+        mmap = os.name != 'nt'
+    with open(path, 'rb') as f:
+        magic, version, header_length = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"'{path}' is not a model file")
+        if version > VERSION:
+            raise ValueError(f"The model file version {version} is newer than the supported version {VERSION}")
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    data_start = _align(_PREFIX.size + header_length)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        offset = data_start + spec['offset']
+        if mmap and np.prod(shape) > 0: # Empty arrays can not be mapped
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+        else:
+            count = int(np.prod(shape))
+            arrays[name] = np.fromfile(path, dtype=dtype, count=count, offset=offset).reshape(shape)
+    return NB.from_arrays(header['meta'], arrays)
+
+
+def _align(position: int) -> int:
+    return -(-position // ALIGNMENT) * ALIGNMENT
@@ -0,0 +1,127 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+from backend.ml.training_store import training_store
+
+
+class ReceiverMemo():
+    ''' Process-wide lookup table of the recurring receivers and their categories.
+
+    Most rows of a banking file are recurring receivers, whose category never changes.
+    The table holds the majority category of each normalized receiver in the labelled
+    transactions, and its support (number of labelled rows) and share (majority rows / support).
+    Only the receivers with enough support, and a clear majority are included,
+    the rest are left for the model to score.
+    The table is rebuilt from the training set, when the time-to-live expires, or it is invalidated.
+    A pinned table is never rebuilt, thus, the worker processes can use the table
+    of the parent process without touching the training set.
+    '''
+
+    def __init__(self, min_support: int = 3, min_share: float = 0.95, ttl: float = 60.0):
+        self.__min_support = min_support
+        self.__min_share = min_share
+        self.__ttl = ttl
+        self.__lock = threading.Lock()
+        self.__table = None # Columns key, category, support, share. None if not built
+        self.__built_at = 0.0
+        self.__pinned = False
+        self.__hits = 0
+        self.__misses = 0
+
+
+    @staticmethod
+    def normalize(receivers: pd.Series) -> pd.Series:
+        ''' Lower case receivers with the whitespace collapsed
+        '''
+        return receivers.fillna('').astype(str).str.replace(r'\s+', ' ', regex=True).str.strip().str.lower()
+
+
+    def lookup(self, receivers: pd.Series):
+        ''' Resolves the receivers with a single merge against the table.
+
+        Inputs
+        ------
+        receivers : pd.Series
+            Raw receiver names
+
+        Returns
+        -------
+        categories : np.array
+            The majority category, or None for the unknown and ambiguous receivers
+        shares : np.array
+            The share of the majority category, 0 for the unresolved receivers
+        '''
+        table = self.__get_table()
+        keys = pd.DataFrame({'key': self.normalize(pd.Series(np.asarray(receivers, dtype=object)))})
+        merged = keys.merge(table[['key', 'category', 'share']], on='key', how='left') # Keeps the row order
+
+        resolved = merged['category'].notna().to_numpy()
+        with self.__lock:
+            self.__hits += int(resolved.sum())
+            self.__misses += int((~resolved).sum())
+        categories = np.where(resolved, merged['category'].to_numpy(dtype=object), None)
+        shares = merged['share'].fillna(0.0).to_numpy()
+        return categories, shares
+
+
+    def get_table(self) -> pd.DataFrame:
+        ''' Returns the current table, columns key, category, support and share
+        '''
+        return self.__get_table()
+
+
+    def pin(self, table: pd.DataFrame):
+        ''' Serve the lookups from the given table, until the memo is invalidated
+
+        Inputs
+        ------
+        table : pd.DataFrame
+            Output of get_table(), e.g. from an other process
+        '''
+        with self.__lock:
+            self.__table = table
+            self.__pinned = True
+
+
+    def invalidate(self):
+        ''' Rebuild the table on the next lookup
+        '''
+        with self.__lock:
+            self.__table = None
+            self.__pinned = False
+
+
+    def stats(self) -> dict:
+        ''' Returns the row hit rate of the lookups, and the table size
+        '''
+        with self.__lock:
+            calls = self.__hits + self.__misses
+            return {
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'hit_rate': self.__hits / calls if calls > 0 else 0.0,
+                'size': self.__table.shape[0] if self.__table is not None else 0
+            }
+
+
+    def __get_table(self) -> pd.DataFrame:
+        with self.__lock:
+            if self.__table is None or (not self.__pinned and time.monotonic() - self.__built_at > self.__ttl):
+                self.__table = self.__build(training_store.get())
+                self.__built_at = time.monotonic()
+            return self.__table
+
+
+    def __build(self, df: pd.DataFrame) -> pd.DataFrame:
+        counts = (pd.DataFrame({'key': self.normalize(df['receiver']), 'category': df['category']})
+                  .groupby(['key', 'category']).size().rename('rows').reset_index())
+        counts['support'] = counts.groupby('key')['rows'].transform('sum')
+        counts = counts.sort_values(['key', 'rows'], ascending=[True, False], kind='stable')
+        table = counts.drop_duplicates('key').copy() # The majority category of each receiver
+        table['share'] = table['rows'] / table['support']
+        table = table.loc[(table['support'] >= self.__min_support) & (table['share'] >= self.__min_share) & (table['key'] != '')]
+        return table[['key', 'category', 'support', 'share']].reset_index(drop=True)
+
+
+receiver_memo = ReceiverMemo()
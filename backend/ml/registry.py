@@ -0,0 +1,86 @@
+import os
+import threading
+
+
+class ModelRegistry():
+    ''' Process-wide cache of the loaded models.
+
+    Every Streamlit session used to load its own copy of the model file.
+    The registry loads each model file version only once, and shares the 
+    read-only instance across all sessions. The version of a file is its 
+    modification time, size and inode, thus, a newly saved file is loaded again
+    on the next access, and the cached instance is swapped atomically under the lock.
+    '''
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__entries = {} # {path: (version, model)}
+        self.__loads = 0
+        self.__hits = 0
+
+
+    def get(self, path: str, loader):
+        ''' Returns the shared model of the file, and loads it, if the file has changed.
+
+        Inputs
+        ------
+        path : str
+            The model file
+        loader : callable
+            Function that loads a model from the path
+
+        Returns
+        -------
+        model
+            The shared instance, or None if the file does not exist
+        '''
+        version = self.__version(path)
+        if version is None:
+            return None
+        
+        with self.__lock: # Concurrent sessions wait for the same load, instead of loading their own copies
+            entry = self.__entries.get(path)
+            if entry is not None and entry[0] == version:
+                self.__hits += 1
+                return entry[1]
+            model = loader(path)
+            self.__entries[path] = (version, model)
+            self.__loads += 1
+            return model
+
+
+    def publish(self, path: str, model):
+        ''' Registers a model that was just saved to the path,
+        so that the file does not have to be loaded again.
+        '''
+        version = self.__version(path)
+        with self.__lock:
+            self.__entries[path] = (version, model)
+
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+
+    def stats(self) -> dict:
+        ''' Returns the load and hit counters, and the memory of the shared models
+        '''
+        with self.__lock:
+            return {
+                'models': len(self.__entries),
+                'loads': self.__loads,
+                'hits': self.__hits,
+                'memory_bytes': sum(model.get_memory_usage() for _, model in self.__entries.values()),
+            }
+
+
+    def __version(self, path: str):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+model_registry = ModelRegistry()
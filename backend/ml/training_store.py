@@ -0,0 +1,127 @@
+import os
+import tempfile
+import threading
+import pandas as pd
+from backend.google_cloud.api import GoogleCloudAPI
+
+
+class TrainingSetStore():
+    ''' Materialized snapshot of the labelled f_transactions rows.
+
+    The snapshot is kept in memory, and persisted as a local Parquet file.
+    The rowid of the table is used as the watermark, since it grows in the
+    commit order, thus, each refresh reads only the rows committed after the 
+    previous one. The CommitTimestamp of the watermark row is also stored, 
+    and if it does not match the database anymore (the database was reset), 
+    the snapshot is rebuilt from scratch.
+    '''
+
+    def __init__(self, path: str = 'training_data.parquet', nan: str = 'N/A'):
+        self.__path = path
+        self.__nan = nan
+        self.__lock = threading.Lock()
+        self.__df = None # The snapshot, sorted by date, None if not loaded
+
+
+    def get(self, date_from=None, date_to=None) -> pd.DataFrame:
+        ''' Returns the labelled rows, after appending the newly committed ones.
+
+        Inputs
+        ------
+        date_from : date
+            Optional inclusive start date
+        date_to : date
+            Optional inclusive end date
+
+        Returns
+        -------
+        df : pd.DataFrame
+            Columns date, receiver, amount and category in the ascending date order
+        '''
+        with self.__lock:
+            df = self.__refresh()
+
+        start = 0 if date_from is None else df['date'].searchsorted(date_from, side='left')
+        end = df.shape[0] if date_to is None else df['date'].searchsorted(date_to, side='right')
+        return df.iloc[start:end][['date', 'receiver', 'amount', 'category']].reset_index(drop=True)
+
+
+    def invalidate(self):
+        ''' Drop the snapshot from memory and disk, and rebuild on the next access
+        '''
+        with self.__lock:
+            self.__df = None
+            if os.path.exists(self.__path):
+                os.remove(self.__path)
+
+
+    def __refresh(self) -> pd.DataFrame:
+        client = GoogleCloudAPI()
+        df = self.__df
+        if df is None and os.path.isfile(self.__path):
+            try:
+                df = pd.read_parquet(self.__path)
+            except OSError:
+                df = None # Removed by an other process, rebuilt from the database
+        if df is not None and not self.__watermark_is_valid(client, df):
+            df = None
+
+        watermark = int(df['row_id'].max()) if df is not None and df.shape[0] > 0 else 0
+        sql = f"""
+        SELECT
+            rowid AS row_id,
+            KeyDate as date,
+            Receiver as receiver,
+            Amount as amount,
+            Category as category,
+            CommitTimestamp as commit_timestamp
+        FROM
+            {client._dataset}.f_transactions
+        WHERE
+            rowid > ? AND Category != ?
+        """
+        new_rows = client.sql_to_pandas(sql, params=(watermark, self.__nan))
+        new_rows['date'] = pd.to_datetime(new_rows['date'], format='%Y-%m-%d').dt.date
+        new_rows = new_rows.dropna()
+
+        if df is None or new_rows.shape[0] > 0:
+            df = new_rows if df is None else pd.concat([df, new_rows], ignore_index=True)
+            df = df.sort_values(['date', 'row_id'], kind='stable').reset_index(drop=True)
+            self.__persist(df)
+        self.__df = df
+        return df
+
+
+    def __persist(self, df: pd.DataFrame):
+        # Other processes may refresh the same file concurrently, thus, each writes its own
+        # temporary file, and the complete file is swapped in atomically
+        directory = os.path.dirname(os.path.abspath(self.__path))
+        with tempfile.NamedTemporaryFile(dir=directory, prefix=os.path.basename(self.__path) + '.', suffix='.tmp', delete=False) as f:
+            tmp_path = f.name
+        try:
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self.__path)
+        except OSError:
+            pass # Lost a race against an invalidate, the in-memory snapshot is still valid
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+    def __watermark_is_valid(self, client: GoogleCloudAPI, df: pd.DataFrame) -> bool:
+        if df.shape[0] == 0:
+            return True
+        last = df.loc[df['row_id'].idxmax()]
+        sql = f"""
+        SELECT
+            CommitTimestamp
+        FROM
+            {client._dataset}.f_transactions
+        WHERE
+            rowid = ?
+        """
+        rows = client.query_rows(sql, (int(last['row_id']),))
+        return len(rows) == 1 and rows[0][0] == last['commit_timestamp']
+
+
+training_store = TrainingSetStore()
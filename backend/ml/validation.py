@@ -0,0 +1,190 @@
+import multiprocessing
+import os
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from backend.ml.model import NB, Tokenizer
+
+
+_encodings = {} # {encoding key: EncodedDataset} of a worker process, set once by the pool initializer
+
+
+class EncodedDataset():
+    ''' The rows of the whole dataset encoded once with one tokenizer and amount bins.
+
+    The (row, token) incidence pairs are deduplicated once, thus,
+    the token document counts of any fold are a single masked bincount.
+    The scoring uses the raw tokens, since repeated tokens are counted in the posterriors.
+    '''
+    def __init__(self, str_features: np.array, float_features: np.array, y: np.array, tokenizer: dict, amount_bins: tuple):
+        nb = NB(Tokenizer(**tokenizer), amount_bins=amount_bins)
+        nb.fit(str_features, float_features, y) # Only for the vocabulary of all rows
+        classes = nb.get_classes()
+        indices, offsets = nb.encode(str_features, float_features)
+
+        self.is_hashing = nb._tokenizer.is_hashing()
+        self.n_targets = classes.shape[0]
+        self.n_tokens = int(indices.max()) + 1 if indices.shape[0] > 0 else 1
+        self.y = pd.Series(np.arange(self.n_targets), index=classes).loc[y].to_numpy()
+
+        self.indices = indices
+        self.offsets = offsets
+        rows = np.repeat(np.arange(offsets.shape[0] - 1), np.diff(offsets))
+        incidence = np.unique(rows * self.n_tokens + indices) # Unique (row, token) pairs, sorted by row
+        self.doc_rows, self.doc_tokens = np.divmod(incidence, self.n_tokens)
+
+
+class CrossValidator():
+    ''' Chronological cross-validation of the model parameters.
+
+    The rows are sorted by date and split into contiguous blocks.
+    With the rolling scheme, each fold trains with all blocks before the validated block,
+    with the kfold scheme, each fold trains with all the other blocks.
+
+    The dataset is encoded once per tokenizer and amount bins combination,
+    and the folds are evaluated in parallel processes. Each fold counts the tokens once,
+    and scores all the smoothing alphas from the same counts.
+    The scores are the same as fitting the model with the rows of the fold.
+    '''
+    def __init__(self, n_folds: int = 5, scheme: str = 'rolling', accepted_error: int = 1, max_workers: int = None):
+        assert n_folds >= 2, 'At least two folds are required'
+        assert scheme in ('rolling', 'kfold'), 'The scheme must be rolling or kfold'
+        self.n_folds = n_folds
+        self.scheme = scheme
+        self.accepted_error = accepted_error
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count()
+
+    def run(self, str_features: np.array, float_features: np.array, y: np.array, dates: np.array = None,
+            alphas: tuple = (1.0,), amount_bins: tuple = ((20, 100),), tokenizers: tuple = ({},)):
+        ''' Evaluates all combinations of the parameters.
+
+        Inputs
+        ------
+        str_features, float_features, y : np.array
+            The model inputs, as in NB.fit()
+        dates : np.array
+            Row dates, used to order the rows. If None, the rows are assumed to be in order
+        alphas : tuple
+            Smoothing strengths
+        amount_bins : tuple
+            (small, large) amount boundaries
+        tokenizers : tuple
+            Tokenizer keyword arguments, e.g. {'n_buckets': 2**16}
+
+        Returns
+        -------
+        results : pd.DataFrame
+            Accuracy and wall-clock seconds of each fold and parameter combination
+        summary : pd.DataFrame
+            Mean accuracy of each parameter combination, in descending order of the accuracy
+        '''
+        if dates is not None:
+            order = np.argsort(np.asarray(dates), kind='stable')
+            str_features, float_features, y = str_features[order], float_features[order], y[order]
+        folds = self._folds(y.shape[0])
+
+        keys = [(repr(tokenizer), tuple(bins)) for tokenizer in tokenizers for bins in amount_bins]
+        encodings = {} # Owned by this run, concurrent runs do not share it
+        encode_seconds = {}
+        for tokenizer in tokenizers:
+            for bins in amount_bins:
+                start = time.perf_counter()
+                encodings[(repr(tokenizer), tuple(bins))] = EncodedDataset(str_features, float_features, y, tokenizer, bins)
+                encode_seconds[(repr(tokenizer), tuple(bins))] = time.perf_counter() - start
+
+        tasks = [(key, fold, train, valid, tuple(alphas), self.accepted_error) for key in keys for fold, (train, valid) in enumerate(folds)]
+        if self.max_workers == 1 or len(tasks) == 1:
+            rows = [_evaluate_encoded_fold(encodings[task[0]], *task) for task in tasks]
+        else:
+            context = multiprocessing.get_context('spawn') # Forking a multi-threaded server is unsafe
+            with ProcessPoolExecutor(self.max_workers, mp_context=context, initializer=_init_worker, initargs=(encodings,)) as pool:
+                rows = list(pool.map(_evaluate_fold, *zip(*tasks)))
+
+        results = pd.DataFrame([row for fold_rows in rows for row in fold_rows])
+        results['encode_seconds'] = [encode_seconds[(tokenizer, bins)] for tokenizer, bins in zip(results['tokenizer'], results['amount_bins'])]
+        summary = results.groupby(['tokenizer', 'amount_bins', 'alpha']).agg(
+            accuracy=('accuracy', 'mean'),
+            accuracy_std=('accuracy', 'std'),
+            accepted_accuracy=('accepted_accuracy', 'mean'),
+            fold_seconds=('fold_seconds', 'mean'),
+            encode_seconds=('encode_seconds', 'first'),
+        ).reset_index()
+        summary = summary.sort_values(by=['accuracy', 'accepted_accuracy'], ascending=False).reset_index(drop=True)
+        return results, summary
+
+    def _folds(self, n_rows: int) -> list:
+        ''' Returns the (train, valid) row ranges of each fold
+        '''
+        n_blocks = self.n_folds + 1 if self.scheme == 'rolling' else self.n_folds
+        assert n_rows >= n_blocks, f'At least {n_blocks} rows are required'
+        bounds = np.linspace(0, n_rows, n_blocks + 1).astype(int)
+
+        folds = []
+        for i in range(self.n_folds):
+            if self.scheme == 'rolling': # Train with the past blocks, validate with the next one
+                folds.append((((0, bounds[i + 1]),), (bounds[i + 1], bounds[i + 2])))
+            else:
+                folds.append((((0, bounds[i]), (bounds[i + 1], n_rows)), (bounds[i], bounds[i + 1])))
+        return folds
+
+
+def _init_worker(encodings: dict):
+    _encodings.update(encodings)
+
+
+def _evaluate_fold(key: tuple, fold: int, train: tuple, valid: tuple, alphas: tuple, accepted_error: int) -> list:
+    ''' Evaluates the fold in a worker process, from the encodings of the pool initializer
+    '''
+    return _evaluate_encoded_fold(_encodings[key], key, fold, train, valid, alphas, accepted_error)
+
+
+def _evaluate_encoded_fold(data: EncodedDataset, key: tuple, fold: int, train: tuple, valid: tuple, alphas: tuple, accepted_error: int) -> list:
+    ''' Fits the fold from the shared encoding, and scores the validation rows with each alpha
+    '''
+    start = time.perf_counter()
+    in_train = np.zeros(data.y.shape[0], dtype=bool)
+    for begin, end in train:
+        in_train[begin:end] = True
+
+    train_pairs = in_train[data.doc_rows]
+    doc_counts = np.bincount(data.y[data.doc_rows[train_pairs]] * data.n_tokens + data.doc_tokens[train_pairs],
+                             minlength=data.n_targets * data.n_tokens).reshape(data.n_targets, data.n_tokens)
+    class_counts = np.bincount(data.y[in_train], minlength=data.n_targets)
+    with np.errstate(divide='ignore'):
+        log_priors = np.log(class_counts / class_counts.sum()) # Targets without training rows can not be predicted
+    count_seconds = time.perf_counter() - start
+
+    # The vocabulary of a fitted fold has only the training tokens, hashed buckets are always known
+    valid_rows = np.arange(valid[0], valid[1])
+    token_slice = slice(data.offsets[valid[0]], data.offsets[valid[1]])
+    pair_tokens = data.indices[token_slice]
+    pair_rows = np.repeat(np.arange(valid_rows.shape[0]), np.diff(data.offsets[valid[0]:valid[1] + 1]))
+    if not data.is_hashing:
+        seen = doc_counts.sum(axis=0)[pair_tokens] > 0
+        pair_rows, pair_tokens = pair_rows[seen], pair_tokens[seen]
+
+    y_valid = data.y[valid_rows]
+    known = class_counts[y_valid] > 0 # Targets unknown to the fold are skipped, as in the validation of the model
+
+    results = []
+    for alpha in alphas:
+        start = time.perf_counter()
+        log_likelihoods = np.log((doc_counts + alpha) / (class_counts[:, np.newaxis] + alpha))
+        posterriors = np.tile(log_priors, (valid_rows.shape[0], 1))
+        np.add.at(posterriors, pair_rows, log_likelihoods.T[pair_tokens])
+
+        order = np.argsort(-posterriors, axis=1, kind='stable')
+        ranks = np.argmax(order == y_valid[:, np.newaxis], axis=1)[known]
+        results.append({
+            'tokenizer': key[0],
+            'amount_bins': key[1],
+            'alpha': alpha,
+            'fold': fold,
+            'train_rows': int(in_train.sum()),
+            'valid_rows': int(known.sum()),
+            'accuracy': float(np.mean(ranks == 0)) if ranks.shape[0] > 0 else np.nan,
+            'accepted_accuracy': float(np.mean(ranks <= accepted_error)) if ranks.shape[0] > 0 else np.nan,
+            'fold_seconds': count_seconds + time.perf_counter() - start,
+        })
+    return results
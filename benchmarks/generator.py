@@ -0,0 +1,112 @@
+import io
+import numpy as np
+import pandas as pd
+
+
+# Receiver name stems of each category, the generated receivers are stems with locations and store numbers
+RECEIVERS = {
+    'FOOD': ['K-SUPERMARKET', 'PRISMA', 'ALEPA', 'LIDL', 'S-MARKET', 'Compass Group Finland Oy', 'K-Citymarket'],
+    'COMMUTING': ['VR-YHTYMÄ OY', 'HSL', 'ABC', 'NESTE', 'Taxi Helsinki'],
+    'CLOTHING': ['STOCKMANN', 'BESTSELLER', 'H&M', 'Zalando', 'Lindex'],
+    'ENTERTAINMENT': ['Finnkino', 'NETFLIX.COM', 'Spotify', 'Ravintola Kämp', 'Galaxie Center & Waino Se'],
+    'HEALTH': ['Yliopiston Apteekki', 'Terveystalo', 'Parturi Äijä', 'Mehiläinen'],
+    'LIVING': ['Helen Oy', 'Vuokranantaja', 'Elisa Oyj', 'Fennovoima'],
+    'HOBBIES': ['Stadium', 'XXL Sports', 'Suomalainen Kirjakauppa', 'Kuntosali Forza'],
+    'TECHNOLOGY': ['Verkkokauppa.com', 'Gigantti', 'Apple.com', 'DNA Oyj'],
+    'SALARY': ['Aalto-yliopisto', 'Työnantaja Oy'],
+}
+LOCATIONS = ['TAPIOLA', 'ISO OMENA', 'OTANIEMI', 'KAMPPI', 'ITÄKESKUS', 'SELLO', 'TAMPERE', 'TURKU', 'OULU', 'ESPOO']
+AMOUNT_SCALES = {'FOOD': 25, 'COMMUTING': 30, 'CLOTHING': 60, 'ENTERTAINMENT': 30, 'HEALTH': 40,
+                 'LIVING': 400, 'HOBBIES': 50, 'TECHNOLOGY': 150, 'SALARY': 3000}
+
+# The column names and formats of the generated file
+COLUMNS = {'date': 'Kirjauspäivä', 'receiver': 'Saaja/Maksaja', 'amount': 'Määrä', 'message': 'Viesti'}
+DATE_FORMAT = '%d.%m.%Y'
+
+
+def generate_transactions(n_rows: int, n_receivers: int = 500, seed: int = 0) -> pd.DataFrame:
+    ''' Generates labelled bank transactions.
+
+    Each receiver belongs to one category, and the receivers follow a Zipf-like
+    distribution, so that the same receivers recur, as in real banking files.
+
+    Inputs
+    ------
+    n_rows : int
+        Number of transactions
+    n_receivers : int
+        Number of distinct receivers
+    seed : int
+        Seed of the random generator, the same seed generates the same rows
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Columns: date, receiver, amount, message, category. In ascending order of the date
+    '''
+    rng = np.random.default_rng(seed)
+
+    categories = np.array(list(RECEIVERS.keys()), dtype=object)
+    receiver_categories = rng.choice(categories, n_receivers)
+    receivers = np.empty(n_receivers, dtype=object)
+    for i, category in enumerate(receiver_categories):
+        stem = rng.choice(RECEIVERS[category])
+        receivers[i] = f'{stem} {rng.choice(LOCATIONS)} {rng.integers(1, 999)}' if category != 'SALARY' else stem
+
+    weights = 1 / np.arange(1, n_receivers + 1) # Zipf-like recurrence of the receivers
+    picks = rng.choice(n_receivers, n_rows, p=weights / weights.sum())
+    category = receiver_categories[picks]
+
+    scales = np.array([AMOUNT_SCALES[value] for value in category])
+    amount = np.round(rng.gamma(2.0, scales / 2.0), 2)
+    amount = np.where(category == 'SALARY', amount, -amount) # Only the salaries are positive
+
+    dates = pd.Timestamp('2020-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 5 * 365, n_rows)), unit='D')
+
+    return pd.DataFrame({
+        'date': dates,
+        'receiver': receivers[picks],
+        'amount': amount,
+        'message': np.where(rng.random(n_rows) < 0.2, 'Viitemaksu', ''),
+        'category': category,
+    })
+
+
+def to_bank_csv(df: pd.DataFrame, encoding: str = 'utf-8', separator: str = ',') -> bytes:
+    ''' Writes the transactions as a raw bank CSV file, without the labels.
+
+    A semicolon separated file uses the decimal comma, as the European banks do.
+
+    Inputs
+    ------
+    df : pd.DataFrame
+        Output of generate_transactions()
+    encoding : str
+        Text encoding of the file, e.g. utf-8, latin-1, cp1252
+    separator : str
+        Column separator, e.g. ',', ';', '\\t', '|'
+
+    Returns
+    -------
+    content : bytes
+        The file as it would be uploaded
+    '''
+    out = df[['date', 'receiver', 'amount', 'message']].rename(columns=COLUMNS)
+    out[COLUMNS['date']] = out[COLUMNS['date']].dt.strftime(DATE_FORMAT)
+
+    buffer = io.BytesIO()
+    out.to_csv(buffer, sep=separator, decimal=',' if separator == ';' else '.', encoding=encoding, index=False)
+    return buffer.getvalue()
+
+
+def filetype() -> dict:
+    ''' The d_filetypes row of the generated files, as the arguments of FilesAPI.add_filetype_to_databases()
+    '''
+    return {
+        'KeyFileName': 'Synthetic Bank',
+        'DateColumn': COLUMNS['date'],
+        'DateColumnFormat': DATE_FORMAT,
+        'AmountColumn': COLUMNS['amount'],
+        'ReceiverColumn': COLUMNS['receiver'],
+        'ColumnNameString': list(COLUMNS.values()),
+    }
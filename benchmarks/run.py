@@ -0,0 +1,164 @@
+''' Times the hot paths of the pipeline with synthetic bank files.
+
+Usage
+-----
+    python -m benchmarks.run --rows 10000 100000 --encodings utf-8 latin-1 --separators , ";" --output results.json
+
+Every stage is repeated, and the best and median wall-clock seconds are written as JSON,
+so that the results of different commits can be compared.
+The SQLite database is created in a temporary directory, the local database is never touched.
+'''
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from benchmarks.generator import generate_transactions, to_bank_csv, filetype
+from backend.google_cloud.api import GoogleCloudAPI
+from backend.files.api import FilesAPI
+from backend.files.coding_registry import coding_registry
+from backend.caches import reset_caches
+from backend.ml.model import NB
+from backend.ml.api import MLAPI
+
+
+def time_stage(run, repeat: int, setup=None) -> list:
+    ''' Returns the wall-clock seconds of each repeat, the setup is not timed
+    '''
+    seconds = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        run(*args)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def reset_database():
+    ''' Starts from an empty database with the synthetic filetype
+    '''
+    reset_caches()
+    if os.path.isfile('my_finance.db'):
+        os.remove('my_finance.db')
+    FilesAPI().add_filetype_to_databases(**filetype())
+
+
+def benchmark_case(n_rows: int, encoding: str, separator: str, repeat: int, seed: int) -> list:
+    ''' Times all stages with one generated file
+    '''
+    df_true = generate_transactions(n_rows, seed=seed)
+    content = to_bank_csv(df_true, encoding=encoding, separator=separator)
+    reset_database()
+    files = FilesAPI()
+    results = []
+
+    def record(stage: str, seconds: list, rows: int):
+        median = statistics.median(seconds)
+        results.append({
+            'stage': stage,
+            'rows': rows,
+            'encoding': encoding,
+            'separator': separator,
+            'file_bytes': len(content),
+            'seconds': seconds,
+            'best': min(seconds),
+            'median': median,
+            'rows_per_second': rows / median if median > 0 else None,
+        })
+
+    # Parsing, cold detects the coding on every repeat, warm reuses the remembered coding of the header
+    fingerprint = coding_registry.fingerprint(content)
+    def cold_file():
+        coding_registry.forget(fingerprint)
+        return (io.BytesIO(content),)
+    record('open_binary_as_pandas_cold', time_stage(files.open_binary_as_pandas, repeat, cold_file), n_rows)
+    files.open_binary_as_pandas(io.BytesIO(content)) # Remembers the coding
+    record('open_binary_as_pandas_warm', time_stage(files.open_binary_as_pandas, repeat, lambda: (io.BytesIO(content),)), n_rows)
+    df_raw = files.open_binary_as_pandas(io.BytesIO(content))
+    record('transform_input_file', time_stage(files.transform_input_file, repeat, lambda: (df_raw.copy(),)), n_rows)
+    df = files.transform_input_file(df_raw.copy())
+    df['Category'] = df_true['category'].loc[df.index].to_numpy() # The transformation sorts the rows, but keeps the index
+    df = df.reset_index(drop=True)
+
+    # Model, the first 80% of the rows are used for the training
+    n_train = int(n_rows * 0.8)
+    X_string, X_numeric, y = df[['Receiver']].to_numpy(), df[['Amount']].to_numpy(), df['Category'].to_numpy()
+    record('NB.fit', time_stage(lambda: NB().fit(X_string[:n_train], X_numeric[:n_train], y[:n_train]), repeat), n_train)
+    nb = NB()
+    nb.fit(X_string[:n_train], X_numeric[:n_train], y[:n_train])
+    record('NB.predict', time_stage(lambda: nb.predict(X_string[n_train:], X_numeric[n_train:]), repeat), n_rows - n_train)
+
+    ml = MLAPI()
+    data = df[['Receiver', 'Amount', 'Category']]
+    ml.train_new_model(data.iloc[:n_train], target_col='Category')
+    record('MLAPI.validate_model', time_stage(lambda: ml.validate_model(data.iloc[n_train:], target_col='Category'), repeat), n_rows - n_train)
+
+    # Database, every repeat commits into an empty database
+    def fresh_commit():
+        reset_database()
+        return FilesAPI(), df.copy()
+    def commit(api, frame):
+        assert api.add_transactions_to_database(frame, 'benchmark'), 'The commit was rolled back'
+    record('add_transactions_to_database', time_stage(commit, repeat, fresh_commit), n_rows)
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'timestamp': pd.Timestamp('now', tz='UTC').isoformat(),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the banking file pipeline with synthetic files')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--encodings', nargs='+', default=['utf-8', 'latin-1'])
+    parser.add_argument('--separators', nargs='+', default=[',', ';'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file of the results, printed if not given')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    cwd = os.getcwd()
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir) # The database path is relative to the working directory
+        try:
+            for n_rows in args.rows:
+                for encoding in args.encodings:
+                    for separator in args.separators:
+                        case = benchmark_case(n_rows, encoding, separator, args.repeat, args.seed)
+                        for row in case:
+                            print(f"{row['stage']:<30} rows={row['rows']:<8} {encoding:<8} {separator!r:<5} median={row['median']:.4f}s", file=sys.stderr)
+                        results.extend(case)
+        finally:
+            GoogleCloudAPI.close_connections()
+            os.chdir(cwd)
+
+    report = json.dumps({'environment': environment(), 'results': results}, indent=2)
+    if output is not None:
+        with open(output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ import hashlib
 import random
 from frontend.utils import init_random_captcha_color,  validate_captcha_color
 from backend.credentials.user import User
+from backend.caches import reset_caches
 
 
 
@@ -69,7 +70,10 @@ if st.button('Login', icon=":material/login:"):
 st.subheader(':orange[If you are having problems using this Application, try to delete the cached data from previous sessions]')
 if st.button('Reset All', icon=":material/cached:"):
     st.success('Removed old Database, and AI model!')
+    reset_caches() # Release the pooled handles and the memory maps before removing the files
     if os.path.exists('my_finance.db'):
         os.remove('my_finance.db')
     if os.path.exists('ai_model.pkl'):
-        os.remove('ai_model.pkl')
\ No newline at end of file
+        os.remove('ai_model.pkl')
+    if os.path.exists('ai_model.bin'):
+        os.remove('ai_model.bin')
\ No newline at end of file
@@ -1,23 +1,18 @@
 import streamlit as st
+import time
 import plotly.graph_objects as go
 from frontend.utils import valid_user_state
 
 valid_user_state()
 
 
-# Utility
-@st.cache_data
-def st_wrapper_pull_training_data():
-    return st.session_state['api']['ml'] .pull_training_data()
-
-
 #Training Section
 st.title('Train a new Naive-Bayes Model')
 
 st.subheader(":orange[7. Now you can use your own data to teach the AI to parse it for you.]")
 
 # Pull the training Data
-df = st.session_state['api']['ml'] .pull_training_data() # Override cache for demo
+df = st.session_state['api']['ml'].pull_training_data() # Incremental, reads only the newly committed rows
 
 if df.shape[0] == 0:
     st.error('There is not Data to train a mode. Uppload new parsed Banking files before.')
@@ -38,8 +33,8 @@ d1 = st.date_input(
     df['date'].max(),
     format='YYYY-MM-DD',
 )
-df = df.loc[(df['date'] > d0) & (df['date'] < d1)]
-df = df.drop('date', axis=1) # Remove the date, that is only used to select the date range
+df_range = df.loc[(df['date'] >= d0) & (df['date'] <= d1)] # Inclusive, the same rows are cross-validated
+df = df_range.drop('date', axis=1) # Remove the date, that is only used to select the date range
 
 # Display the selected training data
 st.subheader(f'Selected Training Data: {df.shape[0]} Rows')
@@ -56,8 +51,26 @@ if df_train.shape[0] <  2:
     st.stop()
 
 
-# Fit the model automatically constantly (if json is shown, this may be slow)
-st.session_state['api']['ml'].train_new_model(df_train, target_col='category')
+# Fit the model in the background, the same parameters are trained only once
+job_id = st.session_state['api']['ml'].submit_training(df_train, target_col='category', params=(d0, d1, ratio))
+job = st.session_state['api']['ml'].get_training_job(job_id)
+
+if job['status'] in ('queued', 'running'):
+    st.progress(job['progress'], text='Training the model...')
+    if st.button('Cancel Training', use_container_width=True):
+        st.session_state['api']['ml'].cancel_training(job_id)
+        st.stop()
+    time.sleep(0.2)
+    st.rerun() # Poll until the job is finished
+
+if job['status'] != 'done':
+    st.error(f"Training {job['status']}: {job['error'] or 'change the parameters, or retry the training'}")
+    if st.button('Retry Training', use_container_width=True):
+        st.session_state['api']['ml'].submit_training(df_train, target_col='category', params=(d0, d1, ratio), retry=True)
+        st.rerun()
+    st.stop()
+
+st.session_state['api']['ml'].activate_trained_model(job_id)
 
 
 st.subheader(":orange[You can simply hit Save, or see what all of the numbers are telling to you.]")
@@ -83,6 +96,27 @@ fig.update_layout(hovermode='x unified')
 fig.update_layout(yaxis_title='Prior Prob. [%]', title='Class Prior Propabilities')
 st.plotly_chart(fig, use_container_width=True)
 
+# Parameter Sweep
+if st.toggle('Cross-Validate the Model Parameters'):
+    scheme = st.radio('Folds', ['rolling', 'kfold'], horizontal=True)
+    n_folds = st.slider('Number of Folds', 2, 10, 5)
+    alphas = st.multiselect('Smoothing Strengths', [0.1, 0.25, 0.5, 1.0, 2.0, 5.0], [0.5, 1.0, 2.0])
+    bins = st.multiselect('Amount Bucket Boundaries', ['10/50', '20/100', '50/200', '100/500'], ['20/100'])
+    vocabularies = st.multiselect('Tokenizer Vocabulary', ['Full', 'Hashed 2^12', 'Hashed 2^16'], ['Full'])
+    if st.button('Run Cross-Validation', use_container_width=True) and alphas and bins and vocabularies:
+        with st.spinner('Evaluating the folds...'):
+            results, summary = st.session_state['api']['ml'].cross_validate(
+                df_range, 
+                target_col='category', 
+                n_folds=n_folds, 
+                scheme=scheme,
+                alphas=tuple(alphas),
+                amount_bins=tuple(tuple(int(bound) for bound in value.split('/')) for value in bins),
+                tokenizers=tuple({'n_buckets': 2 ** int(value.split('^')[1])} if value != 'Full' else {} for value in vocabularies),
+            )
+        st.dataframe(summary, use_container_width=True)
+        st.dataframe(results, use_container_width=True)
+
 # Accuracy Plot
 st.subheader('Validation data Results')
 max_error = st.number_input('Maximum Allowed Error on Placement', 0, 5, 1)
@@ -114,6 +148,31 @@ st.dataframe(
     use_container_width=True
 )
 
+top_k, confusion = st.session_state['api']['ml'].get_validation_report(df_valid, target_col='category', max_k=5)
+
+# Top-k Accuracy Curve
+fig = go.Figure(data=[go.Scatter(
+    x=top_k['k'],
+    y=top_k['accuracy'] * 100,
+    mode='lines+markers',
+    marker_color='red',
+    hovertemplate = '%{y:.2f}%<extra></extra>'
+)])
+fig.update_layout(hovermode='x unified')
+fig.update_layout(xaxis_title='Target within the first k places', yaxis_title='Accuracy [%]', title='Top-k Accuracy')
+st.plotly_chart(fig, use_container_width=True)
+
+# Confusion Matrix
+fig = go.Figure(data=[go.Heatmap(
+    z=confusion.values,
+    x=confusion.columns,
+    y=confusion.index,
+    colorscale='Reds',
+    hovertemplate = 'Actual: %{y}<br>Predicted: %{x}<br>Rows: %{z}<extra></extra>'
+)])
+fig.update_layout(xaxis_title='Predicted Class', yaxis_title='Actual Class', title='Confusion Matrix')
+st.plotly_chart(fig, use_container_width=True)
+
 
 # Print all Likelihoods as JSON
 if st.toggle('Show Likelihoods'):
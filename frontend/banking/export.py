@@ -1,16 +1,40 @@
+import tempfile
 import streamlit as st
+from frontend.utils import valid_user_state
 
+valid_user_state()
 
-st.header('Export Database')
 
-st.subheader(":orange[10. Export your SQL Database and analyse it with your favourite visualization tool. If you are planning to actually use this application, this is not required since the DB is already on you computer.]")
+st.header('Export Database')
 
-with open("my_finance.db", "rb") as file:
-    btn = st.download_button(
-        label="Download SQL",
-        data=file,
-        file_name='my_finance.db',
-    )
+st.subheader(":orange[10. Export your data and analyse it with your favourite visualization tool. If you are planning to actually use this application, this is not required since the DB is already on you computer.]")
+
+TABLES = {'Transactions': 'f_transactions', 'Assets': 'f_assets'}
+FORMATS = {'Parquet': 'parquet', 'CSV (gzip)': 'csv'}
+EXTENSIONS = {'parquet': 'parquet', 'csv': 'csv.gz'}
+
+col1, col2 = st.columns(2)
+with col1:
+    table = TABLES[st.selectbox('Table', TABLES.keys())]
+    date_from = st.date_input('From', value=None)
+with col2:
+    file_format = FORMATS[st.selectbox('Format', FORMATS.keys())]
+    date_to = st.date_input('To', value=None)
+
+if st.button('Prepare the export'):
+    # The rows are streamed to the disk, one chunk at a time. 
+    # Note, the download button reads the finished file into memory, when it is served
+    with tempfile.TemporaryFile() as file:
+        with st.spinner('Exporting...'):
+            stats = st.session_state['api']['export'].export_table(file, user_name=st.session_state['user'].name, table=table,
+                                                                   file_format=file_format, date_from=date_from, date_to=date_to)
+        file.seek(0)
+        st.caption(f"{stats['rows']} rows, {stats['bytes'] / 1e6:.2f} MB in {stats['seconds']:.2f}s")
+        st.download_button(
+            label='Download',
+            data=file,
+            file_name=f'{table}.{EXTENSIONS[file_format]}',
+        )
 
 st.subheader(":orange[To get help to connect your data to PowerBI, you can visit this page.]")
 st.page_link('https://apps.provingground.io/docs/tracer-v1-0-documentation/tracer-power-bi-workflow/how-to-use-sqlite-as-a-power-bi-data-source/', label='How to Connect My SQL', icon="🌎")
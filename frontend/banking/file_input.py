@@ -5,23 +5,13 @@ from frontend.utils import valid_user_state
 valid_user_state()
 
 
-# Utility functions
-@st.cache_data(show_spinner='Validating File entry...')
-def st_wrapper_filetype_in_database(df):
-    return st.session_state['api']['files'].filetype_is_in_database(df)
-
-@st.cache_data(show_spinner='Transforming the File...')
-def st_wrapper_transform_input_file(df):
-    return st.session_state['api']['files'].transform_input_file(df)
-
-
 # Dymaic Visualization Funcs
 def load_file():
     if st.session_state['input_file'] is not None:
         st.session_state['banking_file'] = st.session_state['api']['files'].open_binary_as_pandas(st.session_state['input_file'])
 
 def validate_filetype() -> bool:
-    if st_wrapper_filetype_in_database(st.session_state['banking_file']):
+    if st.session_state['api']['files'].filetype_is_in_database(st.session_state['banking_file']): # In-memory lookup, no need to cache
         st.success('Provided File OK')
         st.subheader(':orange[Good, lets go to process with some AI!]')
         time.sleep(2)
@@ -49,8 +39,6 @@ def validate_filetype() -> bool:
                                                     AmountColumn=amount_col, 
                                                     ReceiverColumn=receiver_col, 
                                                     ColumnNameString=cols)
-            
-            st_wrapper_filetype_in_database.clear(st.session_state['banking_file']) # Clear for rerunning
             return True
 
         st.subheader('Your Banking File')
@@ -59,8 +47,9 @@ def validate_filetype() -> bool:
 
 
 def parse_file():
-    if st_wrapper_filetype_in_database(st.session_state['banking_file']):
-        st.session_state['banking_file'] = st_wrapper_transform_input_file(st.session_state['banking_file'])
+    if st.session_state['api']['files'].filetype_is_in_database(st.session_state['banking_file']):
+        with st.spinner('Transforming the File...'):
+            st.session_state['banking_file'] = st.session_state['api']['files'].transform_input_file(st.session_state['banking_file'])
         st.switch_page('frontend/banking/file_parsing.py')
 
 
@@ -24,14 +24,24 @@ def get_categories():
     old_categories.extend(added_cateogries)
     return old_categories
 
-def push_data():
+def push_data(save_model: bool):
     if not st.session_state['api']['ml'].has_model():
         st.subheader(":orange[Nice work. Now, lets go to train a new model for you at the AI-page, and switch to Admin role from the Login page, if not already in use)]")
     else:
         st.subheader(":orange[Looking good, lets go to see the Assets-page!]")
 
-    if st.session_state['api']['files'].add_transactions_to_database(edited_df, user_name=st.session_state['user'].name):
+    if st.session_state['api']['files'].add_transactions_to_database(edited_df, user_name=st.session_state['user'].name): # The whole file, the existing rows are skipped
+            stats = st.session_state['api']['files'].get_last_commit_stats()
+            if stats['rows'] == 0:
+                st.warning('All rows of the file are already in the database')
+                return
             st.success('File added successfully')
+            st.caption(f"{stats['rows']} new rows committed in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/s), {stats['skipped']} existing rows skipped")
+            new_df = st.session_state['api']['files'].get_last_committed_transactions()[0]
+            if st.session_state['api']['ml'].update_model(new_df[['Receiver', 'Amount', 'Category']], target_col='Category'): # Same features as in the training data, only in this session
+                if save_model:
+                    st.session_state['api']['ml'].save_model_to_gcs()
+                    st.caption('The saved model was updated with the new rows')
     else:
         st.error('File was not uploaded!')
 
@@ -44,6 +54,8 @@ if not st.session_state['api']['ml'].has_model():
     st.subheader(":orange[5. It seems you don't have an active AI model yet, you have to manually insert all categories by using arrows and enter, or use mouse.]")
 else:
     st.subheader(":orange[8. The model is now actice, and it has updated the most likley category to all rows, and the condifence of that prediction is also visible. You should still be cautios and at least validate all rows by yourself.]")
+    memo_stats = st.session_state['api']['ml'].get_receiver_memo_stats()
+    st.caption(f"{memo_stats['hit_rate'] * 100:.0f}% of the predicted rows were resolved from the {memo_stats['size']} known receivers without the model scoring")
 
 edited_df = st.data_editor(
     st.session_state['banking_file'],
@@ -83,14 +95,11 @@ edited_df = st.data_editor(
 if not st.session_state['api']['ml'].has_model():
     st.subheader(":orange[6. After processing all rows, you can push the latest data, and don't wory it has sanity checks to prevent accidental uploads.]")
 
-if st.button('Upload the file', use_container_width=True):
-
-    if st.session_state['api']['files'].date_not_in_transactions_table(edited_df['KeyDate'].min(), user_name=st.session_state['user'].name): # Check for duplicated Dates
-        push_data()
+save_model = False
+if st.session_state['user'].is_admin() and st.session_state['api']['ml'].has_model():
+    save_model = st.toggle('Save the model updated with the new rows', value=False, help='Otherwise, only the model of this session learns from the rows')
 
-    else:
-        st.error(f"There already exists DATE after '{edited_df['KeyDate'].min()}' for user '{st.session_state['user'].name}'")
-
-        st.button('Force Push Data?', on_click=push_data, use_container_width=True)
+if st.button('Upload the file', use_container_width=True):
+    push_data(save_model)
 
 
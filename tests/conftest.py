@@ -0,0 +1,13 @@
+import pytest
+from backend.google_cloud.api import GoogleCloudAPI
+from backend.caches import reset_caches
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    ''' An empty database in a temporary working directory, the database path is relative
+    '''
+    reset_caches()
+    monkeypatch.chdir(tmp_path)
+    yield GoogleCloudAPI()
+    reset_caches()
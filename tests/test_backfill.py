@@ -0,0 +1,38 @@
+import io
+import os
+from backend.files.api import FilesAPI
+from backend.files.backfill import backfill
+from benchmarks.generator import generate_transactions, to_bank_csv, filetype
+
+
+def test_header_only_statement_is_reported_and_skipped(database):
+    FilesAPI().add_filetype_to_databases(**filetype())
+    os.mkdir('statements')
+    df = generate_transactions(200)
+    with open('statements/full.csv', 'wb') as f:
+        f.write(to_bank_csv(df))
+    with open('statements/empty.csv', 'wb') as f:
+        f.write(to_bank_csv(df.iloc[:0]))
+
+    out = io.StringIO()
+    summary = backfill(['statements/empty.csv', 'statements/full.csv'], 'user', workers=2, predict=False, out=out)
+    assert (summary['files'], summary['empty'], summary['failed'], summary['rows']) == (1, 1, 0, 200)
+    assert 'EMPTY    statements/empty.csv' in out.getvalue()
+
+
+def test_files_are_parsed_in_chunks(database):
+    FilesAPI().add_filetype_to_databases(**filetype())
+    os.mkdir('statements')
+    df = generate_transactions(1000)
+    with open('statements/large.csv', 'wb') as f:
+        f.write(to_bank_csv(df))
+    with open('statements/unknown.csv', 'wb') as f:
+        f.write(b'Foo;Bar\n1;2\n')
+
+    out = io.StringIO()
+    summary = backfill(['statements/large.csv', 'statements/unknown.csv'], 'user', workers=2, predict=False, chunk_size=64, out=out)
+    assert (summary['files'], summary['failed'], summary['rows']) == (1, 1, 1000)
+    assert 'FAILED   statements/unknown.csv: ValueError: Unknown filetype' in out.getvalue()
+
+    summary = backfill(['statements/large.csv'], 'user', workers=1, predict=False, chunk_size=64, out=out) # The same rows are recognized
+    assert (summary['rows'], summary['skipped']) == (0, 1000)
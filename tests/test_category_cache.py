@@ -0,0 +1,18 @@
+import sqlite3
+from backend.categories.cache import CategoryCache
+
+
+def test_commit_of_an_other_connection_is_seen_before_the_ttl(database):
+    cache = CategoryCache(ttl=3600.0)
+    assert 'PETS' not in cache.get_names('transaction')
+    loads = cache.version
+    assert 'FOOD' in cache.get_names('transaction')
+    assert cache.version == loads # Served from memory, nothing has changed
+
+    other = sqlite3.connect('my_finance.db') # e.g. the backfill CLI, or an other server process
+    with other:
+        other.execute("INSERT INTO d_category (KeyId, Type, Name, Explanation) VALUES (99, 'transaction', 'PETS', 'Pet food')")
+    other.close()
+
+    assert 'PETS' in cache.get_names('transaction')
+    assert cache.get_row('PETS')['KeyId'] == 99
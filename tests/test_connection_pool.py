@@ -0,0 +1,20 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from backend.google_cloud.api import GoogleCloudAPI, _pool
+
+
+def _child_connection(db_name: str) -> tuple:
+    conn = _pool.connection(db_name)
+    return id(conn), _pool.stats()['misses'], conn.execute('SELECT COUNT(*) FROM d_category').fetchone()[0]
+
+
+def test_forked_children_open_their_own_connections(database):
+    parent = _pool.connection('my_finance.db')
+    with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('fork')) as pool:
+        results = list(pool.map(_child_connection, ['my_finance.db'] * 4))
+
+    for conn_id, misses, n_categories in results:
+        assert conn_id != id(parent)
+        assert misses >= 1 # The inherited connection was not a hit
+        assert n_categories > 0
+    assert _pool.connection('my_finance.db') is parent # The parent keeps its connection
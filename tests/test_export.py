@@ -0,0 +1,29 @@
+import datetime
+import gzip
+import io
+import pandas as pd
+from backend.export.api import ExportAPI
+from backend.files.api import FilesAPI
+
+
+def test_export_is_per_user_and_date_filtered(database):
+    days = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(10)]
+    files = FilesAPI()
+    assert files.add_transactions_to_database(pd.DataFrame({'KeyDate': days, 'Amount': -1.0, 'Receiver': 'Lidl', 'Category': 'FOOD'}), 'user')
+    assert files.add_transactions_to_database(pd.DataFrame({'KeyDate': days[:3], 'Amount': -2.0, 'Receiver': 'HSL', 'Category': None}), 'other')
+
+    export = ExportAPI(chunk_size=4)
+    out = io.BytesIO()
+    stats = export.export_table(out, 'user')
+    out.seek(0)
+    df = pd.read_parquet(out)
+    assert (stats['rows'], stats['chunks']) == (10, 3)
+    assert df['KeyUser'].unique().tolist() == ['user']
+    assert df['KeyDate'].tolist() == days
+
+    out = io.BytesIO()
+    stats = export.export_table(out, 'user', file_format='csv', date_from=days[2], date_to=days[5])
+    out.seek(0)
+    df = pd.read_csv(gzip.GzipFile(fileobj=out))
+    assert stats['rows'] == 4 and df.shape[0] == 4 # The header is written once
+    assert df['KeyDate'].tolist() == [day.isoformat() for day in days[2:6]]
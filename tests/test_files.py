@@ -0,0 +1,56 @@
+import io
+import pytest
+from backend.files.api import FilesAPI
+from backend.files.coding_registry import coding_registry
+from backend.files.filetype_registry import filetype_registry
+from benchmarks.generator import generate_transactions, to_bank_csv, filetype
+
+
+def test_unknown_filetype_is_reported_before_transforming(database):
+    content = b'a,b\n1,2\n3,4\n'
+    with pytest.raises(ValueError, match='Unknown filetype'):
+        list(FilesAPI().iter_transformed_input_file(io.BytesIO(content), chunksize=1))
+    with pytest.raises(ValueError, match='Unknown filetype'):
+        FilesAPI().transform_input_file(FilesAPI().open_binary_as_pandas(io.BytesIO(content)))
+
+
+def test_chunked_transform_of_a_known_filetype(database):
+    files = FilesAPI()
+    files.add_filetype_to_databases(**filetype())
+    content = to_bank_csv(generate_transactions(1000), separator=';')
+    chunks = list(files.iter_transformed_input_file(io.BytesIO(content), chunksize=300))
+    assert [chunk.shape[0] for chunk in chunks] == [300, 300, 300, 100]
+    assert chunks[0].columns.tolist() == ['KeyDate', 'Amount', 'Receiver', 'Category']
+
+
+def test_first_added_filetype_wins(database):
+    files = FilesAPI()
+    files.add_filetype_to_databases(**filetype())
+    files.add_filetype_to_databases(**dict(filetype(), KeyFileName='Duplicate', DateColumnFormat='%Y-%m-%d'))
+    assert filetype_registry.get(','.join(filetype()['ColumnNameString']))['KeyFileName'] == 'Synthetic Bank'
+
+
+def test_wrong_remembered_coding_is_replaced(database):
+    files = FilesAPI()
+    files.add_filetype_to_databases(**filetype())
+    content = to_bank_csv(generate_transactions(100), encoding='latin-1', separator=';')
+    fingerprint = coding_registry.fingerprint(content)
+    files.open_binary_as_pandas(io.BytesIO(content))
+    detected = coding_registry.get(fingerprint)
+    assert detected[1] == ';'
+
+    for wrong in [('utf-8', ';'), (detected[0], ',')]: # Fails to decode, and parses as one wide column
+        coding_registry.forget(fingerprint)
+        coding_registry.remember(fingerprint, *wrong, 'Synthetic Bank')
+        assert files.filetype_is_in_database(files.open_binary_as_pandas(io.BytesIO(content)))
+        assert coding_registry.get(fingerprint) == detected
+
+    coding_registry.forget(fingerprint)
+    coding_registry.remember(fingerprint, detected[0], ',', 'Synthetic Bank')
+    chunks = list(files.iter_binary_as_pandas(io.BytesIO(content), chunksize=30))
+    assert sum(chunk.shape[0] for chunk in chunks) == 100
+    assert all(files.filetype_is_in_database(chunk) for chunk in chunks)
+    assert coding_registry.get(fingerprint) == detected
+
+    coding_registry.invalidate() # The replaced coding is persisted
+    assert coding_registry.get(fingerprint) == detected
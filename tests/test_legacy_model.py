@@ -0,0 +1,39 @@
+import pickle
+import pandas as pd
+from backend.ml.model import NB
+from backend.ml.registry import model_registry
+from backend.ml.api import MLAPI
+
+
+def legacy_model() -> NB:
+    ''' The attributes of a model pickled by the first version, the likelihoods are nested dicts
+    '''
+    nb = NB.__new__(NB)
+    nb.__dict__.update({
+        '_y_encode': {'FOOD': 0, 'COMMUTING': 1},
+        '_y_decode': {0: 'FOOD', 1: 'COMMUTING'},
+        '_X_encode': {'lidl': 0, 'hsl': 1, 'small': 2},
+        '_X_decode': {0: 'lidl', 1: 'hsl', 2: 'small'},
+        '_priors': {0: 0.6, 1: 0.4},
+        '_likelihoods': {0: {0: 0.9, 1: 0.1, 2: 0.8}, 1: {0: 0.1, 1: 0.9, 2: 0.7}},
+        '_propabilities': {},
+    })
+    return nb
+
+
+def test_legacy_pickle_loads_and_reports_memory(database):
+    with open('ai_model.pkl', 'wb') as f:
+        pickle.dump(legacy_model(), f)
+    model_registry.clear()
+    try:
+        ml = MLAPI()
+        ml.load_model_from_gcs()
+        assert ml.has_model()
+
+        stats = MLAPI.get_registry_stats()
+        assert stats['memory_bytes'] > 0
+
+        categories, _ = ml.predict(pd.DataFrame({'Receiver': ['LIDL'], 'Amount': [-10.0]}))
+        assert categories == ['FOOD']
+    finally:
+        model_registry.clear()
@@ -0,0 +1,138 @@
+import re
+import numpy as np
+import pytest
+from backend.ml.model import NB
+
+
+class BaselineNB():
+    ''' The dict-based model of the first version, kept as the reference of the matrix implementation
+    '''
+    def __init__(self):
+        self._y_encode = {}
+        self._y_decode = {}
+        self._X_encode = {}
+        self._X_decode = {}
+        self._priors = {}
+        self._likelihoods = {}
+
+    def fit(self, str_features: np.array, float_features: np.array, y: np.array):
+        def word_coder(values: list) -> dict:
+            decode = {i: label for i, label in enumerate(set(values))}
+            encode = {label: i for i, label in enumerate(set(values))}
+            return encode, decode
+
+        str_features = np.concatenate((str_features, self._transform_X_float(float_features)), axis=1)
+        nested_word_list = self._process_str_features(str_features)
+        word_list = set(value for nested in nested_word_list for value in nested)
+
+        self._X_encode, self._X_decode = word_coder(word_list)
+        self._y_encode, self._y_decode = word_coder(y)
+
+        X_str = self._transform_X(str_features)
+        y = np.array([self._y_encode[label] for label in y])
+
+        labels, counts = np.unique(y, return_counts=True)
+        self._priors = {target: prior for target, prior in zip(labels, counts / y.shape[0])}
+        for target in np.unique(y):
+            sub_set = X_str[y[:] == target]
+            features = np.unique(sub_set[(sub_set != -1)])
+            known_unkowns = [k for k in self._X_decode if k not in features]
+            features = np.concatenate((features, known_unkowns), axis=0)
+            events = sub_set.shape[0]
+            probs = [(np.sum(np.any(sub_set == token, axis=1)) + 1) / (events + 1) for token in features]
+            self._likelihoods.update({target: {feature: prob for feature, prob in zip(features, probs)}})
+
+    def predict(self, str_features: np.array, float_features: np.array):
+        str_features = np.concatenate((str_features, self._transform_X_float(float_features)), axis=1)
+        predictions = []
+        for str_row in self._transform_X(str_features):
+            target_values = {}
+            for target in self._y_decode:
+                likes = [self._likelihoods[target][feature] for feature in str_row if feature in self._likelihoods[target]]
+                target_values.update({target: np.exp(np.log(likes).sum() + np.log(self._priors[target]))})
+            predictions.append({self._y_decode[k]: v for k, v in sorted(target_values.items(), key=lambda item: item[1], reverse=True)})
+        return predictions
+
+    def get_likelihoods(self):
+        likes = {}
+        for target in {self._y_decode[k]: v for k, v in sorted(self._priors.items(), key=lambda item: item[1], reverse=True)}:
+            likes[target] = {self._X_decode[k]: v for k, v in self._likelihoods[self._y_encode[target]].items()}
+        return likes
+
+    def _transform_X(self, str_features: np.array) -> np.array:
+        X_str = self._process_str_features(str_features)
+        n_cols = len(max(X_str, key=len))
+        for i, row in enumerate(X_str):
+            coded = [self._X_encode[word] if word in self._X_encode else -1 for word in row]
+            X_str[i] = np.pad(coded, (0, n_cols - len(coded)), 'constant', constant_values=(-1))
+        return np.array(X_str)
+
+    def _transform_X_float(self, float_features: np.array) -> np.array:
+        X_float = np.empty((float_features.shape), dtype=object)
+        X_float[np.abs(float_features) >= 100] = 'largeAmount'
+        X_float[np.abs(float_features) < 100] = 'mediumAmount'
+        X_float[np.abs(float_features) < 20] = 'smallAmount'
+        X_float_sign = np.empty((float_features.shape), dtype=object)
+        X_float_sign[float_features >= 0] = 'positiveCashflow'
+        X_float_sign[float_features < 0] = 'negativeCashflow'
+        return np.concatenate((X_float, X_float_sign), axis=1)
+
+    def _process_str_features(self, str_features: np.array):
+        merged = np.array([' '.join(row) for row in str_features])
+        return [[word for word in re.split(r'[.;,_*\s-]+', str(row).lower()) if not word.isdigit()] for row in merged]
+
+
+def training_rows(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    receivers = ['Lidl Espoo', 'Lidl Kamppi', 'HSL', 'HSL Mobiili', 'K-Market 123', 'Alko Oy', 'Palkka Oy', 'VR Matkat']
+    categories = {'Lidl': 'FOOD', 'K-Market': 'FOOD', 'HSL': 'COMMUTING', 'VR': 'COMMUTING', 'Alko': 'ALCOHOL', 'Palkka': 'SALARY'}
+    X_string = np.array([[receivers[i]] for i in rng.integers(0, len(receivers), n)], dtype=object)
+    X_numeric = np.round(rng.uniform(-300, 300, (n, 1)), 2)
+    y = np.array([next(label for prefix, label in categories.items() if row[0].startswith(prefix)) for row in X_string], dtype=object)
+    return X_string, X_numeric, y
+
+
+def assert_same_predictions(predictions: list, expected: list):
+    assert len(predictions) == len(expected)
+    for row, expected_row in zip(predictions, expected):
+        assert list(row.keys()) == list(expected_row.keys()) # Same order of the categories
+        assert list(row.values()) == pytest.approx(list(expected_row.values()), rel=1e-9)
+
+
+def test_predictions_and_likelihoods_match_the_baseline():
+    X_string, X_numeric, y = training_rows(300)
+    X_test = np.array([['Lidl HSL'], ['Alko'], ['unknown receiver'], ['VR 42']], dtype=object)
+    X_test_numeric = np.array([[-15.0], [-150.0], [50.0], [2500.0]])
+
+    baseline, nb = BaselineNB(), NB()
+    baseline.fit(X_string, X_numeric, y)
+    nb.fit(X_string, X_numeric, y)
+
+    assert_same_predictions(nb.predict(X_test, X_test_numeric), baseline.predict(X_test, X_test_numeric))
+    assert_same_predictions(nb.predict(X_string, X_numeric), baseline.predict(X_string, X_numeric))
+
+    likelihoods, expected = nb.get_likelihoods(), baseline.get_likelihoods()
+    assert list(likelihoods.keys()) == list(expected.keys())
+    for target, values in likelihoods.items():
+        assert values == pytest.approx(expected[target], rel=1e-12)
+
+
+def test_partial_fit_equals_fitting_all_rows():
+    X_string, X_numeric, y = training_rows(400, seed=1)
+    X_extra = np.array([['Stockmann'], ['Stockmann Helsinki'], ['HSL']], dtype=object) # New tokens and a new target
+    X_extra_numeric = np.array([[-80.0], [-120.0], [-2.8]])
+    y_extra = np.array(['SHOPPING', 'SHOPPING', 'COMMUTING'], dtype=object)
+    X_all = np.concatenate((X_string, X_extra))
+    X_all_numeric = np.concatenate((X_numeric, X_extra_numeric))
+
+    full, incremental = NB(), NB()
+    full.fit(X_all, X_all_numeric, np.concatenate((y, y_extra)))
+    incremental.fit(X_string, X_numeric, y)
+    incremental.partial_fit(X_extra, X_extra_numeric, y_extra)
+
+    assert_same_predictions(incremental.predict(X_all, X_all_numeric), full.predict(X_all, X_all_numeric))
+    assert incremental.get_priors() == pytest.approx(full.get_priors(), rel=1e-12)
+    likelihoods, expected = incremental.get_likelihoods(), full.get_likelihoods()
+    assert likelihoods.keys() == expected.keys()
+    for target, values in likelihoods.items():
+        assert values == pytest.approx(expected[target], rel=1e-12)
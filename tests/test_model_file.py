@@ -0,0 +1,95 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+from backend.ml.api import MLAPI
+from backend.ml.model import NB, Tokenizer
+from backend.ml.model_file import save_model, load_model
+from backend.ml.registry import model_registry
+
+
+def fitted_model() -> NB:
+    X_string = np.array([['Lidl Espoo'], ['HSL'], ['Lidl Kamppi'], ['HSL Kamppi']], dtype=object)
+    X_numeric = np.array([[-10.0], [-2.5], [-30.0], [-2.5]])
+    nb = NB()
+    nb.fit(X_string, X_numeric, np.array(['FOOD', 'COMMUTING', 'FOOD', 'COMMUTING'], dtype=object))
+    return nb, X_string, X_numeric
+
+
+def test_windows_loads_into_memory_and_the_file_can_be_replaced(tmp_path, monkeypatch):
+    nb, X_string, X_numeric = fitted_model()
+    path = str(tmp_path / 'ai_model.bin')
+    save_model(nb, path)
+
+    assert isinstance(load_model(path)._log_likelihoods, np.memmap) # POSIX default
+    with monkeypatch.context() as patch:
+        patch.setattr(os, 'name', 'nt')
+        loaded = load_model(path)
+    assert not isinstance(loaded._log_likelihoods, np.memmap)
+
+    save_model(nb, path) # Replaces the file under the loaded model
+    os.remove(path)
+    assert loaded.predict(X_string, X_numeric) == nb.predict(X_string, X_numeric)
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip(tmp_path, mmap):
+    nb, X_string, X_numeric = fitted_model()
+    path = str(tmp_path / 'ai_model.bin')
+    save_model(nb, path)
+    loaded = load_model(path, mmap=mmap)
+
+    assert loaded.predict(X_string, X_numeric) == nb.predict(X_string, X_numeric)
+    assert loaded.get_likelihoods() == nb.get_likelihoods()
+    assert loaded.get_priors() == nb.get_priors()
+    assert loaded.get_params() == nb.get_params()
+
+    y = np.array(['SHOPPING'], dtype=object)
+    loaded.partial_fit(np.array([['Stockmann']], dtype=object), np.array([[-50.0]]), y) # The read-only arrays are replaced, not modified
+    nb.partial_fit(np.array([['Stockmann']], dtype=object), np.array([[-50.0]]), y)
+    assert loaded.predict(X_string, X_numeric) == nb.predict(X_string, X_numeric)
+
+
+def test_round_trip_of_a_hashing_model(tmp_path):
+    X_string = np.array([['Lidl Espoo'], ['HSL'], ['Lidl Kamppi']], dtype=object)
+    X_numeric = np.array([[-10.0], [-2.5], [-30.0]])
+    nb = NB(Tokenizer(n_buckets=64), alpha=0.5, amount_bins=(10, 50))
+    nb.fit(X_string, X_numeric, np.array(['FOOD', 'COMMUTING', 'FOOD'], dtype=object))
+    path = str(tmp_path / 'ai_model.bin')
+    save_model(nb, path)
+    loaded = load_model(path)
+
+    assert loaded.get_params() == nb.get_params()
+    assert loaded.predict(X_string, X_numeric) == nb.predict(X_string, X_numeric)
+
+
+def test_not_a_model_file(tmp_path):
+    path = str(tmp_path / 'ai_model.bin')
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 64)
+    with pytest.raises(ValueError):
+        load_model(path)
+
+
+def test_pickled_model_is_loaded_without_a_model_file(database):
+    nb, _, _ = fitted_model()
+    with open('ai_model.pkl', 'wb') as f:
+        pickle.dump(nb, f)
+    model_registry.clear()
+    try:
+        ml = MLAPI()
+        ml.load_model_from_gcs()
+        assert ml.has_model()
+        categories, _ = ml.predict(pd.DataFrame({'Receiver': ['Lidl', 'HSL'], 'Amount': [-20.0, -2.5]}))
+        assert categories == ['FOOD', 'COMMUTING']
+
+        save_model(nb, 'ai_model.bin') # The model file is used, the pickle is only the fallback
+        os.remove('ai_model.pkl')
+        model_registry.clear()
+        ml = MLAPI()
+        ml.load_model_from_gcs()
+        categories, _ = ml.predict(pd.DataFrame({'Receiver': ['Lidl'], 'Amount': [-20.0]}))
+        assert categories == ['FOOD']
+    finally:
+        model_registry.clear()
@@ -0,0 +1,29 @@
+import pandas as pd
+from backend.ml.api import MLAPI
+from backend.ml.model import NB
+from backend.ml.receiver_memo import receiver_memo
+
+
+def test_memo_rows_are_not_scored_by_the_model(database, monkeypatch):
+    ml = MLAPI()
+    train = pd.DataFrame({'Receiver': ['Lidl Espoo', 'HSL', 'Lidl Espoo', 'HSL'], 'Amount': [-10.0, -2.5, -12.0, -2.5],
+                          'Category': ['FOOD', 'COMMUTING', 'FOOD', 'COMMUTING']})
+    ml.train_new_model(train, target_col='Category')
+    receiver_memo.pin(pd.DataFrame({'key': ['hsl'], 'category': ['COMMUTING'], 'support': [10], 'share': [0.97]}))
+
+    scored = []
+    predict_proba = NB.predict_proba
+    def spy(self, str_features, float_features):
+        scored.append(str_features.shape[0])
+        return predict_proba(self, str_features, float_features)
+    monkeypatch.setattr(NB, 'predict_proba', spy)
+
+    data = pd.DataFrame({'Receiver': ['HSL', 'Lidl Espoo', 'HSL', 'Lidl Espoo'], 'Amount': [-2.5, -11.0, -2.5, -9.0]}, index=[7, 3, 5, 1])
+    categories, probs = ml.predict(data)
+    assert scored == [2]
+    assert categories == ['COMMUTING', 'FOOD', 'COMMUTING', 'FOOD']
+    assert probs[0] == probs[2] == 0.97
+
+    scored.clear()
+    ml.predict(data.iloc[[0, 2]]) # Every row resolved by the memo
+    assert scored == []
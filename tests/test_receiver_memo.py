@@ -0,0 +1,14 @@
+import os
+import pandas as pd
+from backend.ml.receiver_memo import ReceiverMemo
+
+
+def test_pinned_table_never_touches_the_training_set(database):
+    table = pd.DataFrame({'key': ['k-market espoo'], 'category': ['FOOD'], 'support': [10], 'share': [1.0]})
+    memo = ReceiverMemo(ttl=0.0) # Would rebuild on every lookup, if not pinned
+    memo.pin(table)
+
+    categories, shares = memo.lookup(pd.Series(['K-MARKET  Espoo', 'Unknown']))
+    assert list(categories) == ['FOOD', None]
+    assert list(shares) == [1.0, 0.0]
+    assert not os.path.exists('training_data.parquet')
@@ -0,0 +1,42 @@
+import threading
+from backend.ml.jobs import TrainingJobManager
+
+
+def wait(jobs: TrainingJobManager, job_id: str):
+    jobs.get(job_id).future.result(timeout=10)
+
+
+def test_failed_job_is_not_restarted_until_retried():
+    jobs = TrainingJobManager(max_workers=1)
+    calls = []
+    def train(progress):
+        calls.append(1)
+        raise ValueError('no labels')
+
+    job_id = jobs.submit('key', train)
+    wait(jobs, job_id)
+    assert jobs.submit('key', train) == job_id # A rerun with the same parameters
+    assert jobs.get(job_id).status == 'failed'
+    assert len(calls) == 1
+
+    retried = jobs.submit('key', train, retry=True)
+    wait(jobs, retried)
+    assert retried != job_id and len(calls) == 2
+
+
+def test_cancelled_job_stays_cancelled():
+    jobs = TrainingJobManager(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+    def train(progress):
+        started.set()
+        release.wait(10)
+        progress(0.5) # Raises TrainingCancelled
+        return 'model'
+
+    job_id = jobs.submit('key', train)
+    started.wait(10)
+    assert jobs.cancel(job_id)
+    release.set()
+    wait(jobs, job_id)
+    assert jobs.submit('key', train) == job_id
+    assert jobs.get(job_id).status == 'cancelled'
@@ -0,0 +1,30 @@
+import datetime
+import glob
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from backend.files.api import FilesAPI
+from backend.ml.training_store import TrainingSetStore
+
+
+def _refresh(_) -> int:
+    return TrainingSetStore().get().shape[0] # A fresh store reads the shared file, or rebuilds it
+
+
+def test_concurrent_refreshes_share_the_snapshot_file(database):
+    rows = [(datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 300), -float(i), f'Receiver {i % 50}', 'FOOD') for i in range(5000)]
+    assert FilesAPI().add_transactions_to_database(pd.DataFrame(rows, columns=['KeyDate', 'Amount', 'Receiver', 'Category']), 'user')
+
+    with ProcessPoolExecutor(8) as pool:
+        sizes = list(pool.map(_refresh, range(32)))
+
+    assert sizes == [5000] * 32
+    assert glob.glob('training_data.parquet.*') == [] # No temporary files are left behind
+    assert pd.read_parquet('training_data.parquet').shape[0] == 5000
+
+
+def test_hot_queries_use_an_index(database):
+    plans = database.check_query_plans().set_index('query')
+
+    assert plans['uses_index'].all(), plans
+    assert 'training_data' in plans.index
+    assert database.query_rows("SELECT name FROM sqlite_master WHERE name = 'ix_f_transactions_category'") == []
@@ -0,0 +1,36 @@
+import datetime
+import pandas as pd
+from backend.files.api import FilesAPI
+
+
+def transactions(rows: list) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=['KeyDate', 'Amount', 'Receiver', 'Category'])
+
+
+def test_repeated_same_day_rows_split_across_uploads(database):
+    files = FilesAPI()
+    day = datetime.date(2024, 1, 5)
+    assert files.add_transactions_to_database(transactions([(day, -10.0, 'Lunch', 'FOOD')]), 'user')
+
+    upload = transactions([(day, -10.0, 'Lunch', 'FOOD'), (day, -10.0, 'Lunch', 'FOOD'), (day, -2.5, 'Bus', 'COMMUTING')])
+    assert files.add_transactions_to_database(upload, 'user')
+
+    stats = files.get_last_commit_stats()
+    assert (stats['rows'], stats['skipped']) == (2, 1)
+    committed = files.get_last_committed_transactions()[0]
+    assert sorted(committed['Receiver']) == ['Bus', 'Lunch']
+
+    stored = database.sql_to_pandas("SELECT Receiver FROM f_transactions WHERE KeyUser = ?", ('user',))
+    assert sorted(stored['Receiver']) == ['Bus', 'Lunch', 'Lunch']
+
+
+def test_reupload_skips_every_row(database):
+    files = FilesAPI()
+    day = datetime.date(2024, 1, 5)
+    upload = transactions([(day, -10.0, 'Lunch', 'FOOD'), (day, -10.0, 'Lunch', 'FOOD')])
+    assert files.add_transactions_to_database(upload, 'user')
+    assert files.add_transactions_to_database(upload, 'user')
+    assert files.get_last_commit_stats()['rows'] == 0
+    assert files.get_last_committed_transactions()[0].shape[0] == 0
+    assert files.add_transactions_to_database(upload, 'other') # The rows are identified per user
+    assert files.get_last_commit_stats()['rows'] == 2
@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from backend.ml.validation import CrossValidator
+
+
+def dataset(n_rows: int, seed: int):
+    rng = np.random.default_rng(seed)
+    y = rng.choice(np.array(['FOOD', 'HEALTH', 'LIVING'], dtype=object), n_rows)
+    receivers = np.array([f'{label} store {rng.integers(5)}' for label in y], dtype=object)
+    return receivers[:, np.newaxis], -rng.gamma(2.0, 20.0, (n_rows, 1)), y
+
+
+def test_concurrent_runs_do_not_share_encodings():
+    def run(seed: int):
+        return CrossValidator(n_folds=3, max_workers=seed % 2 + 1).run(*dataset(3000, seed), alphas=(0.5, 1.0))
+
+    with ThreadPoolExecutor(4) as sessions: # Admin sessions of the same server
+        outputs = list(sessions.map(run, range(8)))
+
+    for results, summary in outputs:
+        assert results.shape[0] == 3 * 2
+        assert summary['accuracy'].between(0, 1).all()
+
+
+def test_serial_and_parallel_runs_agree():
+    data = dataset(600, 2)
+    serial, _ = CrossValidator(n_folds=3, max_workers=1).run(*data)
+    parallel, _ = CrossValidator(n_folds=3, max_workers=2).run(*data)
+    assert serial['accuracy'].tolist() == parallel['accuracy'].tolist()